@@ -0,0 +1,69 @@
+"""
+Benchmark for the modes of csv_test_solution.write_fixed_csv.
+
+Generates a CSV with the schema of test.csv, cleans it with the row at a
+time loop, the columnar batch mode, the mmap reader and any requested
+worker counts, checks
+that every mode wrote the same output, and reports the throughput of each.
+
+    python benchmarks/bench_csv_modes.py [--rows N] [--workers 2 4 ...]
+"""
+import argparse
+import filecmp
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'csv_test'))
+
+from csv_test_solution import write_fixed_csv
+from generators import generate_csv
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--rows', type=int, default=200000,
+                        help='number of rows to generate, e.g. 10000000 (default: 200000)')
+    parser.add_argument('--extra-columns', type=int, default=0,
+                        help='filler columns to add to each row to make it wider (default: 0)')
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help='rows per block in columnar mode (default: 10000)')
+    parser.add_argument('--workers', type=int, nargs='*', default=[],
+                        help='worker counts to also time in columnar mode')
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        input_filename = os.path.join(temp_dir, 'input.csv')
+        generate_csv(input_filename, args.rows, extra_columns=args.extra_columns)
+
+        modes = [('row at a time', {}),
+                 ('columnar', {'columnar': True, 'batch_size': args.batch_size}),
+                 ('mmap', {'use_mmap': True})]
+        for workers in args.workers:
+            modes.append(('columnar, {} workers'.format(workers),
+                          {'columnar': True, 'workers': workers}))
+
+        baseline = None
+        for name, kwargs in modes:
+            output_filename = os.path.join(temp_dir, 'output.csv')
+            start = time.time()
+            write_fixed_csv(input_filename, output_filename, **kwargs)
+            elapsed = time.time() - start
+            if baseline is None:
+                baseline = elapsed
+                shutil.move(output_filename, os.path.join(temp_dir, 'expected.csv'))
+            elif not filecmp.cmp(output_filename, os.path.join(temp_dir, 'expected.csv'),
+                                 shallow=False):
+                sys.exit('{} mode wrote a different output'.format(name))
+            print '{:<24} {:>8.2f} s {:>12,.0f} rows/s {:>6.2f}x'.format(
+                name, elapsed, args.rows / elapsed, baseline / elapsed)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
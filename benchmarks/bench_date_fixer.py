@@ -0,0 +1,63 @@
+"""
+Micro-benchmark for the date normalizer used by csv_test_solution.
+
+Times plain dateutil parsing against DateNormalizer on the start_date
+column of a CSV, repeated out to the requested number of rows, and
+reports the cache hit rate and the cost per row of each.
+
+    python benchmarks/bench_date_fixer.py [csv_filename] [--rows N]
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'csv_test'))
+
+from csv_test_solution import DateNormalizer, parse_date
+
+
+def read_start_dates(csv_filename):
+    "Returns the start_date column of a CSV as a list of strings"
+    with open(csv_filename, 'rb') as csv_file:
+        reader = csv.reader(csv_file)
+        start_date_ind = reader.next().index('start_date')
+        return [line[start_date_ind] for line in reader]
+
+
+def time_per_row(func, dates):
+    "Returns the average number of microseconds func takes on each date"
+    start = time.time()
+    for date in dates:
+        func(date)
+    return (time.time() - start) * 1e6 / len(dates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('csv_filename', nargs='?',
+                        default=os.path.join(ROOT, 'csv_test', 'test.csv'))
+    parser.add_argument('--rows', type=int, default=100000,
+                        help='number of rows to time (default: 100000)')
+    args = parser.parse_args()
+
+    start_dates = read_start_dates(args.csv_filename)
+    dates = (start_dates * (args.rows // len(start_dates) + 1))[:args.rows]
+
+    normalizer = DateNormalizer()
+    dateutil_cost = time_per_row(parse_date, dates)
+    normalizer_cost = time_per_row(normalizer.normalize, dates)
+
+    print 'rows:                 {}'.format(len(dates))
+    print 'distinct dates:       {}'.format(len(set(dates)))
+    print 'cache hit rate:       {:.1%}'.format(normalizer.hit_rate())
+    print 'fast path parses:     {} of {} misses'.format(normalizer.fast_path_hits, normalizer.misses)
+    print 'dateutil per row:     {:.2f} us'.format(dateutil_cost)
+    print 'normalizer per row:   {:.2f} us'.format(normalizer_cost)
+    print 'speedup:              {:.1f}x'.format(dateutil_cost / normalizer_cost)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark for simulate_missions in rover_puzzle/solution.py.
+
+Generates independent missions, each a rover and a command string on a
+plateau of its own, runs them all together with NumPy and one at a time
+with Plateau.run_commands, checks that every rover ends up in the same
+place, and reports the missions and steps per second of each. Needs NumPy.
+
+    python benchmarks/bench_rover_batch.py [--missions N] [--commands N]
+"""
+import argparse
+import cStringIO
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'rover_puzzle'))
+
+from solution import HEADINGS, Plateau, simulate_missions
+
+
+def make_missions(missions, commands, size):
+    generator = random.Random(0)
+    plateaus, rovers, command_strings = [], [], []
+    for _ in range(missions):
+        far_right, top = generator.randint(1, size), generator.randint(1, size)
+        plateaus.append((far_right, top))
+        rovers.append((generator.randint(0, far_right), generator.randint(0, top),
+                       generator.choice('NESW')))
+        command_strings.append(''.join(generator.choice('LRMMM') for _ in range(commands)))
+    return plateaus, rovers, command_strings
+
+
+def run_one_at_a_time(plateaus, rovers, command_strings):
+    positions = []
+    stdout = sys.stdout
+    sys.stdout = cStringIO.StringIO()  # Blocked move messages
+    try:
+        for plateau, rover, commands in zip(plateaus, rovers, command_strings):
+            plat = Plateau(*plateau)
+            plat.create_rover(*rover)
+            plat.run_commands(commands)
+            positions.append((plat.rover.x, plat.rover.y, plat.rover.facing))
+    finally:
+        sys.stdout = stdout
+    return positions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--missions', type=int, default=100000,
+                        help='number of missions (default: 100000)')
+    parser.add_argument('--commands', type=int, default=100,
+                        help='commands in each mission (default: 100)')
+    parser.add_argument('--size', type=int, default=20,
+                        help='largest width and height of a plateau (default: 20)')
+    args = parser.parse_args()
+
+    plateaus, rovers, command_strings = make_missions(args.missions, args.commands, args.size)
+    steps = args.missions * args.commands
+
+    start = time.time()
+    result = simulate_missions(plateaus, rovers, command_strings)
+    batch_seconds = time.time() - start
+    batch_positions = zip(result.x.tolist(), result.y.tolist(),
+                          [HEADINGS[heading] for heading in result.heading.tolist()])
+
+    start = time.time()
+    positions = run_one_at_a_time(plateaus, rovers, command_strings)
+    seconds = time.time() - start
+    if positions != batch_positions:
+        sys.exit('The batch simulation gave different results')
+
+    for name, seconds in (('simulate_missions', batch_seconds), ('one at a time', seconds)):
+        print '{:<18} {:10,.0f} missions/sec {:14,.0f} steps/sec'.format(
+            name, args.missions / seconds, steps / seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+Benchmark for the rover fleet store in rover_puzzle/solution.py.
+
+Reports the bytes each rover takes as an object with its own dict and
+turning tables, as the Rover class used to be, and in a Fleet's arrays.
+Then runs a mission for every rover one command at a time on a copy of
+the plateau and rovers from before the fleet, one command at a time on
+the fleet, and with Plateau.run_commands, and reports the steps per
+second of each.
+
+    python benchmarks/bench_rover_fleet.py [--rovers N] [--commands N]
+"""
+import argparse
+import cStringIO
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'rover_puzzle'))
+
+from solution import Plateau
+
+
+class ObjectRover():
+    "The rover from before the fleet store, for comparison"
+    def __init__(self, x, y, facing):
+        self.x = int(x)
+        self.y = int(y)
+        self.facing = facing.upper()
+        self.left = {'N': 'W', 'W': 'S', 'S': 'E', 'E': 'N'}
+        self.right = {'N': 'E', 'E': 'S', 'S': 'W', 'W': 'N'}
+        self.move = {'N': [0, 1], 'E': [1, 0], 'S': [0, -1], 'W': [-1, 0]}
+
+    def get_position(self):
+        return {'x': self.x, 'y': self.y, 'facing': self.facing}
+
+    def get_next_position_if_moved(self):
+        movement = self.move[self.facing]
+        return [self.x + movement[0], self.y + movement[1]]
+
+    def move_forward(self):
+        new_position = self.get_next_position_if_moved()
+        if all(coord >= 0 for coord in new_position):
+            self.x, self.y = new_position
+        else:
+            print 'Movement failed, cannot move to negative coordinates'
+
+    def turn_left(self):
+        self.facing = self.left[self.facing]
+
+    def turn_right(self):
+        self.facing = self.right[self.facing]
+
+
+class ObjectPlateau():
+    "The plateau from before the fleet store, keeping a list of ObjectRovers"
+    def __init__(self, x, y):
+        self.far_right = int(x)
+        self.top = int(y)
+        self.retired_rovers = []
+        self.rover = False
+
+    def create_rover(self, x, y, facing):
+        if self.rover:
+            self.retired_rovers.append(self.rover)
+        self.rover = ObjectRover(int(x), int(y), facing.upper())
+
+    def rover_check(self):
+        assert self.rover, 'You cannot perform an operation on a rover without creating one first'
+
+    def move_rover(self):
+        self.rover_check()
+        next_position = self.rover.get_next_position_if_moved()
+        if next_position[0] > self.far_right or next_position[1] > self.top:
+            print 'Movement failed, cannot move rover off the edge of the plateau'
+            return
+        self.rover.move_forward()
+
+    def turn_rover_left(self):
+        self.rover_check()
+        self.rover.turn_left()
+
+    def turn_rover_right(self):
+        self.rover_check()
+        self.rover.turn_right()
+
+    def print_rovers(self):
+        if self.rover:
+            self.retired_rovers.append(self.rover)
+        for rover in self.retired_rovers:
+            position = rover.get_position()
+            print "{} {} {}".format(position['x'], position['y'], position['facing'])
+
+
+def deep_size(obj, seen):
+    "Returns the bytes taken by an object and what it refers to, counting each object once"
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += deep_size(obj.__dict__, seen)
+    return size
+
+
+def make_missions(rovers, commands, size):
+    generator = random.Random(0)
+    return [((generator.randrange(size), generator.randrange(size), generator.choice('NESW')),
+             ''.join(generator.choice('LRMMM') for _ in range(commands)))
+            for _ in range(rovers)]
+
+
+def run_step_by_step(plat, missions):
+    plat_commands = {'R': plat.turn_rover_right,
+                     'L': plat.turn_rover_left,
+                     'M': plat.move_rover}
+    for rover, commands in missions:
+        plat.create_rover(*rover)
+        for command in commands:
+            plat_commands[command]()
+
+
+def run_compiled(plat, missions):
+    for rover, commands in missions:
+        plat.create_rover(*rover)
+        plat.run_commands(commands)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--rovers', type=int, default=100000,
+                        help='number of rovers (default: 100000)')
+    parser.add_argument('--commands', type=int, default=50,
+                        help='commands in each mission (default: 50)')
+    parser.add_argument('--size', type=int, default=1000,
+                        help='width and height of the plateau (default: 1000)')
+    args = parser.parse_args()
+
+    missions = make_missions(args.rovers, args.commands, args.size)
+    object_rovers = [ObjectRover(*rover) for rover, _ in missions]
+    seen = set()
+    object_bytes = sum(deep_size(rover, seen) for rover in object_rovers)
+    del object_rovers
+    plat = Plateau(args.size, args.size)
+    for rover, _ in missions:
+        plat.create_rover(*rover)
+    fleet_bytes = deep_size(plat.fleet, set())
+    print 'Bytes per rover: {:.1f} as objects, {:.1f} in a fleet'.format(
+        float(object_bytes) / args.rovers, float(fleet_bytes) / args.rovers)
+
+    results = []
+    before = None
+    for name, plateau_class, run in (
+            ('before, one at a time', ObjectPlateau, run_step_by_step),
+            ('fleet, one at a time', Plateau, run_step_by_step),
+            ('fleet, run_commands', Plateau, run_compiled)):
+        plat = plateau_class(args.size, args.size)
+        stdout = sys.stdout
+        sys.stdout = cStringIO.StringIO()  # Blocked move messages
+        try:
+            start = time.time()
+            run(plat, missions)
+            seconds = time.time() - start
+            plat.print_rovers()
+            results.append(sys.stdout.getvalue())
+        finally:
+            sys.stdout = stdout
+        steps_per_second = args.rovers * args.commands / seconds
+        before = before or steps_per_second
+        print '{:<22} {:12,.0f} steps/sec {:6.2f}x'.format(
+            name, steps_per_second, steps_per_second / before)
+    if len(set(results)) > 1:
+        sys.exit('The ways of running missions gave different results')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Benchmark for TrajectoryRecorder in rover_puzzle/solution.py.
+
+Records a few rovers running millions of commands each, with checkpoints at
+a range of spacings. Reports how fast commands are recorded, the memory the
+commands, checkpoints, visit lists and coverage bitmap take, and the
+latency of point in time and cell visit queries. Cell visit queries check
+every rover's bitmap, so they're also timed with many shorter rovers.
+
+    python benchmarks/bench_rover_trajectory.py [--rovers N] [--steps N]
+        [--visit-rovers N ...]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'rover_puzzle'))
+
+from solution import Plateau, TrajectoryRecorder
+
+
+def make_commands(generator, steps):
+    "Returns a command string that wanders, with runs of moves between turns"
+    pieces = []
+    length = 0
+    while length < steps:
+        piece = generator.choice('LR') + 'M' * generator.randint(1, 40)
+        pieces.append(piece)
+        length += len(piece)
+    return ''.join(pieces)[:steps]
+
+
+def recorder_bytes(recorder):
+    "Returns roughly how many bytes the recorder's data takes"
+    total = recorder.coverage.nbytes()
+    for trajectory, visited in zip(recorder.trajectories, recorder.visited):
+        total += sum(sys.getsizeof(values) for values in (
+            trajectory.commands, trajectory.xs, trajectory.ys, trajectory.headings,
+            trajectory.offsets))
+        total += visited.nbytes()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--rovers', type=int, default=3,
+                        help='number of rovers (default: 3)')
+    parser.add_argument('--steps', type=int, default=2000000,
+                        help='commands each rover runs (default: 2000000)')
+    parser.add_argument('--size', type=int, default=2000,
+                        help='width and height of the plateau (default: 2000)')
+    parser.add_argument('--checkpoint-every', type=int, nargs='*', default=[256, 4096, 65536],
+                        help='checkpoint spacings to try (default: 256 4096 65536)')
+    parser.add_argument('--queries', type=int, default=1000,
+                        help='queries of each kind to time (default: 1000)')
+    parser.add_argument('--visit-rovers', type=int, nargs='*', default=[10, 100, 1000, 10000],
+                        help='numbers of rovers, of --visit-steps each, to time cell visit '
+                             'queries with (default: 10 100 1000 10000)')
+    parser.add_argument('--visit-steps', type=int, default=1000,
+                        help='commands each of those rovers runs (default: 1000)')
+    args = parser.parse_args()
+
+    generator = random.Random(0)
+    missions = [((generator.randrange(args.size), generator.randrange(args.size),
+                  generator.choice('NESW')), make_commands(generator, args.steps))
+                for _ in range(args.rovers)]
+    steps = [(generator.randrange(args.rovers), generator.randint(0, args.steps))
+             for _ in range(args.queries)]
+    cells = [(generator.randrange(args.size), generator.randrange(args.size))
+             for _ in range(args.queries)]
+
+    print '{} rovers of {:,} steps on a {}x{} plateau'.format(
+        args.rovers, args.steps, args.size, args.size)
+    for checkpoint_every in args.checkpoint_every:
+        recorder = TrajectoryRecorder(checkpoint_every)
+        plat = Plateau(args.size - 1, args.size - 1, quiet=True, recorder=recorder)
+        start = time.time()
+        for rover, commands in missions:
+            plat.create_rover(*rover)
+            plat.run_commands(commands)
+        record_seconds = time.time() - start
+
+        start = time.time()
+        for rover, step in steps:
+            recorder.position_at(rover, step)
+        position_seconds = time.time() - start
+        start = time.time()
+        for x, y in cells:
+            recorder.rovers_visiting(x, y)
+        visit_seconds = time.time() - start
+
+        print ('checkpoint every {:6d}: {:10,.0f} steps/sec recorded, {:6.1f} MB, '
+               '{:8.1f} us per position, {:5.1f} us per cell, {:,} cells covered').format(
+            checkpoint_every, args.rovers * args.steps / record_seconds,
+            recorder_bytes(recorder) / 1e6, position_seconds * 1e6 / args.queries,
+            visit_seconds * 1e6 / args.queries, len(recorder.coverage))
+
+    # Queries on visited cells, which can't be answered from the coverage alone
+    for rovers in args.visit_rovers:
+        recorder = TrajectoryRecorder()
+        plat = Plateau(args.size - 1, args.size - 1, quiet=True, recorder=recorder)
+        positions = []
+        for _ in range(rovers):
+            plat.create_rover(generator.randrange(args.size), generator.randrange(args.size),
+                              generator.choice('NESW'))
+            plat.run_commands(make_commands(generator, args.visit_steps))
+            positions.append((plat.rover.x, plat.rover.y))
+        cells = [generator.choice(positions) for _ in range(args.queries)]
+        start = time.time()
+        for x, y in cells:
+            recorder.rovers_visiting(x, y)
+        visit_seconds = time.time() - start
+        print '{:6d} rovers of {:,} steps: {:9.1f} us per visited cell'.format(
+            rovers, args.visit_steps, visit_seconds * 1e6 / args.queries)
+
+
+if __name__ == '__main__':
+    main()
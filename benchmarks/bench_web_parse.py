@@ -0,0 +1,90 @@
+"""
+Benchmark for parsing pages in web_scraper_test_solution.
+
+Parses output.html and generated listing and company pages in the same
+markup with BeautifulSoup and with the one pass extract_page, checks that
+both find the same paths and rows, and reports the time per page and the
+peak memory of each. Each parser runs in its own process, so peak memory
+is the growth in maximum resident set size while parsing.
+
+    python benchmarks/bench_web_parse.py [--pages N] [--rows-per-page N]
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'web_scrape'))
+
+from fake_company_site import FakeCompanySite
+import web_scraper_test_solution as scraper
+
+
+def soup_parse(html):
+    soup = scraper.make_soup(html)
+    return (scraper.get_company_paths_on_page(soup), scraper.get_path_to_next_page(soup),
+            scraper.parse_table_rows_for_company_data(soup) if 'Company Website' in html else {})
+
+
+def fast_parse(html, use_lxml=True):
+    page = scraper.extract_page(html, use_lxml)
+    return page.company_paths, page.next_path, page.rows if 'Company Website' in html else {}
+
+
+def make_pages(pages, rows_per_page):
+    "Returns output.html followed by listing and company pages of the fake site"
+    with open(os.path.join(ROOT, 'web_scrape', 'output.html')) as html_file:
+        result = [html_file.read()]
+    site = FakeCompanySite(companies=pages * rows_per_page, per_page=rows_per_page)
+    for page in range(1, pages + 1):
+        result.append(site.listing_page(page))
+        result.append(site.company_page(page))
+    return result
+
+
+def time_parser(parse, pages, results):
+    "Parses every page, putting the results, seconds taken and peak memory growth on a queue"
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    parsed = [parse(html) for html in pages]
+    seconds = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    results.put((parsed, seconds, peak))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--pages', type=int, default=200,
+                        help='listing pages, and as many company pages, to parse (default: 200)')
+    parser.add_argument('--rows-per-page', type=int, default=10,
+                        help='companies on each listing page (default: 10)')
+    args = parser.parse_args()
+
+    pages = make_pages(args.pages, args.rows_per_page)
+    parsers = [('BeautifulSoup', soup_parse), ('extract_page', fast_parse)]
+    if scraper.etree is not None:
+        parsers.append(('extract_page, HTMLParser', lambda html: fast_parse(html, False)))
+
+    print '{} pages, {} bytes, lxml {}'.format(
+        len(pages), sum(len(html) for html in pages),
+        'installed' if scraper.etree is not None else 'not installed')
+    baseline = None
+    for name, parse in parsers:
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=time_parser, args=(parse, pages, results))
+        process.start()
+        parsed, seconds, peak = results.get()
+        process.join()
+        if baseline is None:
+            baseline = parsed, seconds
+        elif parsed != baseline[0]:
+            sys.exit('{} found different paths or rows'.format(name))
+        print '{:<26} {:8.3f} ms/page  peak +{:6d} KB  {:5.1f}x'.format(
+            name, seconds * 1000 / len(pages), peak, baseline[1] / seconds)
+
+
+if __name__ == '__main__':
+    main()
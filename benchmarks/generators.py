@@ -0,0 +1,214 @@
+"""
+Generators for synthetic benchmark inputs: CSVs with the schema of
+test.csv, the fake company site with any number of listing and company
+pages, and rover mission files. Each is reproducible from its seed. They
+can also be run to write a file, or serve the site, for trying the
+scripts by hand.
+
+    python benchmarks/generators.py csv people.csv --rows N
+    python benchmarks/generators.py missions missions.txt --rovers N --commands N
+    python benchmarks/generators.py site --listing-pages M --companies K
+"""
+import argparse
+import csv
+import datetime
+import itertools
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'csv_test'))
+sys.path.insert(0, os.path.join(ROOT, 'web_scrape'))
+
+from csv_test_solution import STATE_ABBREVIATIONS_FILENAME, read_record
+from fake_company_site import SURNAMES, FakeCompanySite
+
+TEST_CSV = os.path.join(ROOT, 'csv_test', 'test.csv')
+
+FIRST_NAMES = ['Nathalia', 'Ottilie', 'Ignacio', 'Suzie', 'Trumaine', 'Georgie', 'Arsenio',
+               'Hardie', 'Leone', 'Jewell', 'Joline', 'Emiliano', 'Alvira', 'Ismael',
+               'Marchello']
+NAME_PREFIXES = ['', '', '', '', 'Mrs. ', 'Ms. ', 'Mr. ', 'Dr. ']
+NAME_SUFFIXES = ['', '', '', '', ' DDS', ' MD', ' PhD', ' Jr.']
+STREETS = ['Brooks', 'Glens', 'Mission', 'Mountains', 'Islands', 'Branch', 'Turnpike',
+           'Rapid', 'Causeway', 'Row', 'Lights', 'Corners', 'Parkways', 'Trace', 'Pike']
+JOBS = ['Tax inspector', 'Merchandiser, retail', 'Broadcast journalist', 'Early years teacher',
+        'Ranger/warden', 'Colour technologist', 'Engineer, manufacturing',
+        'Scientist, biomedical', 'Dispensing optician', 'Lexicographer']
+WORDS = ('autem vero aliquid repellendus illo distinctio reiciendis excepturi aut ducimus '
+         'sint dignissimos et similique sunt ullam sit culpa possimus laudantium earum '
+         'doloribus assumenda voluptatibus quia non ex ratione eligendi veniam').split()
+# What separates the sentences of a bio, as messy as in test.csv
+BIO_GAPS = [' ', ' ', ' ', '  ', '\t ', '\n ', '      ', '   \t ', '\n\n ']
+# Formats of valid start dates, with the month spelled out or not
+DATE_FORMATS = ['{month:02d}/{day:02d}/{year}', '{month_name} {day}, {year}',
+                '{year}-{month:02d}-{day:02d}']
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August',
+               'September', 'October', 'November', 'December']
+
+
+def add_columns(record, values):
+    "Adds fields to the end of a raw CSV record, keeping its line ending"
+    stripped = record.rstrip('\r\n')
+    return ','.join([stripped] + values) + record[len(stripped):]
+
+
+def generate_csv(output_filename, rows, source_filename=TEST_CSV, extra_columns=0):
+    """
+    Writes a CSV with the given number of data rows, made by cycling
+    through the records of the source CSV, which keeps its schema and
+    its mix of messy bios and dates. Extra columns of filler make the
+    rows wider
+    """
+    with open(source_filename, 'rb') as source:
+        header = read_record(source)
+        records = list(iter(lambda: read_record(source), ''))
+
+    if extra_columns:
+        header = add_columns(header, ['extra_{}'.format(i) for i in range(extra_columns)])
+        filler = ['filler value {}'.format(i) for i in range(extra_columns)]
+        records = [add_columns(record, filler) for record in records]
+
+    with open(output_filename, 'wb') as output:
+        output.write(header)
+        for record in itertools.islice(itertools.cycle(records), rows):
+            output.write(record)
+
+
+def sentence(generator):
+    words = [generator.choice(WORDS) for _ in range(generator.randint(3, 10))]
+    return ' '.join(words).capitalize() + '.'
+
+
+def messy_bio(generator):
+    "Returns a few sentences separated by runs of spaces, tabs and newlines"
+    pieces = []
+    for _ in range(generator.randint(2, 4)):
+        pieces.append(sentence(generator))
+        pieces.append(generator.choice(BIO_GAPS))
+    if generator.random() < 0.5:
+        pieces.pop()  # Only some bios end in whitespace
+    return ''.join(pieces)
+
+
+def start_date(generator, invalid_fraction):
+    """
+    Returns a start date in one of the formats of test.csv, or, with a
+    chance of invalid_fraction, an invalid one: words, a day that doesn't
+    exist, or a month and year without a day
+    """
+    date = datetime.date(1970, 1, 1) + datetime.timedelta(generator.randint(0, 16800))
+    if generator.random() < invalid_fraction:
+        return generator.choice([
+            sentence(generator).split()[0] + ' ' + sentence(generator).split()[-1],
+            '02/{}/{}'.format(generator.randint(30, 31), date.year),
+            '{:02d}/{:02d}'.format(date.month, date.year % 100),
+            '{} {}'.format(MONTH_NAMES[date.month - 1], date.year)])
+    return generator.choice(DATE_FORMATS).format(
+        year=date.year, month=date.month, day=date.day, month_name=MONTH_NAMES[date.month - 1])
+
+
+def generate_people_csv(output_filename, rows, seed=0, invalid_fraction=0.1):
+    """
+    Writes a CSV with the schema of test.csv and the given number of made
+    up rows, with messy bios and start dates in mixed formats, about
+    invalid_fraction of which aren't valid dates. Unlike generate_csv, the
+    dates and bios rarely repeat
+    """
+    generator = random.Random(seed)
+    with open(STATE_ABBREVIATIONS_FILENAME, 'rb') as state_file:
+        states = [row[0] for row in csv.reader(state_file)][1:]
+    with open(output_filename, 'wb') as output:
+        writer = csv.writer(output)
+        writer.writerow(['name', 'gender', 'birthdate', 'address', 'city', 'state', 'zipcode',
+                         'email', 'bio', 'job', 'start_date'])
+        for _ in xrange(rows):
+            first, last = generator.choice(FIRST_NAMES), generator.choice(SURNAMES)
+            birthdate = datetime.date(1970, 1, 1) + datetime.timedelta(generator.randint(0, 16800))
+            writer.writerow([
+                generator.choice(NAME_PREFIXES) + first + ' ' + last + generator.choice(NAME_SUFFIXES),
+                generator.choice('MF'),
+                str(birthdate),
+                '{} {} {}{}'.format(generator.randint(1, 99999), generator.choice(SURNAMES),
+                                    generator.choice(STREETS),
+                                    generator.choice(['', ' Suite {}'.format(generator.randint(100, 999)),
+                                                      ' Apt. {:03d}'.format(generator.randint(0, 999))])),
+                generator.choice(['', 'East ', 'West ', 'Port ', 'Lake ']) + generator.choice(SURNAMES) + 'town',
+                generator.choice(states),
+                '{:05d}'.format(generator.randint(0, 99999)),
+                '{}.{}@example.com'.format(first.lower(), last.lower()),
+                messy_bio(generator),
+                generator.choice(JOBS),
+                start_date(generator, invalid_fraction)])
+
+
+def make_company_site(listing_pages, companies, latency=0.0):
+    """
+    Returns a FakeCompanySite, not yet started, with the given number of
+    company pages spread over the given number of listing pages
+    """
+    per_page = max(1, -(-companies // max(1, listing_pages)))
+    return FakeCompanySite(companies=companies, per_page=per_page, latency=latency)
+
+
+def write_missions(output, size, rovers, commands, seed=0):
+    """
+    Writes missions like main's input to a file object: a size by size
+    plateau, then each rover at a random cell followed by a random string
+    of commands, mostly moves
+    """
+    generator = random.Random(seed)
+    output.write('{0} {0}\n'.format(size))
+    for _ in xrange(rovers):
+        output.write('{} {} {}\n'.format(generator.randint(0, size), generator.randint(0, size),
+                                         generator.choice('NESW')))
+        output.write(''.join(generator.choice('LRMMM') for _ in xrange(commands)) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    subparsers = parser.add_subparsers(dest='kind')
+    csv_parser = subparsers.add_parser('csv', help='write a CSV with the schema of test.csv')
+    csv_parser.add_argument('output_filename')
+    csv_parser.add_argument('--rows', type=int, default=100000,
+                            help='number of rows (default: 100000)')
+    csv_parser.add_argument('--invalid-fraction', type=float, default=0.1,
+                            help='fraction of invalid start dates (default: 0.1)')
+    csv_parser.add_argument('--seed', type=int, default=0)
+    missions_parser = subparsers.add_parser('missions', help='write a rover mission file')
+    missions_parser.add_argument('output_filename')
+    missions_parser.add_argument('--size', type=int, default=1000,
+                                 help='width and height of the plateau (default: 1000)')
+    missions_parser.add_argument('--rovers', type=int, default=10000,
+                                 help='number of rovers (default: 10000)')
+    missions_parser.add_argument('--commands', type=int, default=100,
+                                 help='commands for each rover (default: 100)')
+    missions_parser.add_argument('--seed', type=int, default=0)
+    site_parser = subparsers.add_parser('site', help='serve the fake company site until stopped')
+    site_parser.add_argument('--listing-pages', type=int, default=10,
+                             help='number of listing pages (default: 10)')
+    site_parser.add_argument('--companies', type=int, default=100,
+                             help='number of company pages (default: 100)')
+    site_parser.add_argument('--latency', type=float, default=0.0,
+                             help='seconds to wait before each response (default: 0)')
+    args = parser.parse_args()
+
+    if args.kind == 'csv':
+        generate_people_csv(args.output_filename, args.rows, args.seed, args.invalid_fraction)
+    elif args.kind == 'missions':
+        with open(args.output_filename, 'wb') as output:
+            write_missions(output, args.size, args.rovers, args.commands, args.seed)
+    else:
+        with make_company_site(args.listing_pages, args.companies, args.latency) as site:
+            print 'Serving {} listing pages at {}'.format(site.pages, site.url)
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+Benchmark suite for the three tools, at a range of input sizes.
+
+Generates inputs with generators.py at each scale: a CSV with the schema
+of test.csv for write_fixed_csv, the fake company site for web_scrape, and
+a mission file for the rovers. Each run happens in its own process, and
+its time, throughput and peak memory growth are reported and can be
+written to JSON. Given a baseline from an earlier --save-baseline, exits
+with an error if any benchmark's throughput drops, or its peak memory
+grows, by more than the threshold.
+
+    python benchmarks/run_benchmarks.py [--scales small medium large] [-o results.json]
+    python benchmarks/run_benchmarks.py --save-baseline baseline.json
+    python benchmarks/run_benchmarks.py --baseline baseline.json [--threshold 0.25]
+"""
+import argparse
+import collections
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'rover_puzzle'))
+sys.path.insert(0, os.path.join(ROOT, 'web_scrape'))
+sys.path.insert(0, os.path.join(ROOT, 'csv_test'))
+
+from csv_test_solution import write_fixed_csv
+from generators import generate_people_csv, make_company_site, write_missions
+from solution import run_mission_stream
+import web_scraper_test_solution as scraper
+
+SCALES = collections.OrderedDict([
+    ('small', {'csv_rows': 2000, 'listing_pages': 5, 'companies': 50,
+               'plateau': 100, 'rovers': 1000, 'commands': 100}),
+    ('medium', {'csv_rows': 20000, 'listing_pages': 20, 'companies': 500,
+                'plateau': 1000, 'rovers': 10000, 'commands': 100}),
+    ('large', {'csv_rows': 200000, 'listing_pages': 100, 'companies': 5000,
+               'plateau': 10000, 'rovers': 100000, 'commands': 100}),
+])
+
+# Growth in peak memory smaller than this is put down to noise
+MEMORY_NOISE_KB = 4096
+
+
+def csv_benchmark(scale, temp_dir, **kwargs):
+    input_filename = os.path.join(temp_dir, 'people.csv')
+    generate_people_csv(input_filename, scale['csv_rows'])
+    output_filename = os.path.join(temp_dir, 'people_fixed.csv')
+    return scale['csv_rows'], 'rows', lambda: write_fixed_csv(input_filename, output_filename,
+                                                              **kwargs)
+
+
+def scrape_benchmark(scale, temp_dir, fast=False):
+    site = make_company_site(scale['listing_pages'], scale['companies']).start()
+    output_filename = os.path.join(temp_dir, 'companies.json')
+
+    def scrape():
+        fetcher = scraper.Fetcher(stats=scraper.ScrapeStats())
+        scraper.web_scrape(site.url, output_filename, fetcher, fast)
+
+    def check():
+        with open(output_filename) as output:
+            if json.load(output) != site.expected_json():
+                return 'web_scrape wrote the wrong companies'
+    return site.pages + scale['companies'], 'pages', scrape, check, site.stop
+
+
+def rover_benchmark(scale, temp_dir, collisions=None):
+    input_filename = os.path.join(temp_dir, 'missions.txt')
+    with open(input_filename, 'wb') as missions:
+        write_missions(missions, scale['plateau'], scale['rovers'], scale['commands'])
+
+    def run():
+        with open(input_filename, 'rb') as stream, open(os.devnull, 'wb') as output:
+            run_mission_stream(stream, output, collisions, quiet=True)
+    return scale['rovers'] * scale['commands'], 'steps', run
+
+
+BENCHMARKS = collections.OrderedDict([
+    ('write_fixed_csv', csv_benchmark),
+    ('write_fixed_csv columnar', lambda scale, temp_dir: csv_benchmark(scale, temp_dir,
+                                                                       columnar=True)),
+    ('web_scrape', scrape_benchmark),
+    ('web_scrape fast', lambda scale, temp_dir: scrape_benchmark(scale, temp_dir, fast=True)),
+    ('rover missions', rover_benchmark),
+    # Generated rovers can start on each other, so collisions are reported, not blocked
+    ('rover missions, collisions', lambda scale, temp_dir: rover_benchmark(scale, temp_dir,
+                                                                           'report')),
+])
+
+
+def time_run(run, results):
+    "Runs a benchmark, putting the seconds taken and peak memory growth in KB on a queue"
+    sys.stdout = open(os.devnull, 'w')  # Progress messages
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    run()
+    seconds = time.time() - start
+    results.put((seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before))
+
+
+def run_benchmark(name, scale_name, repeat):
+    """
+    Runs a benchmark at a scale repeat times, each in a new process, and
+    returns a dict of the fastest run's results. A benchmark returns the
+    items it works through, their unit and the function to time, and can
+    add a function that returns an error if the output is wrong, and one
+    that stops anything it started, which is called however the runs end
+    """
+    temp_dir = tempfile.mkdtemp()
+    try:
+        setup = BENCHMARKS[name](SCALES[scale_name], temp_dir)
+        items, unit, run = setup[:3]
+        check, stop = list(setup[3:]) + [None] * (5 - len(setup))
+        runs = []
+        try:
+            for _ in range(repeat):
+                results = multiprocessing.Queue()
+                process = multiprocessing.Process(target=time_run, args=(run, results))
+                process.start()
+                process.join()
+                if process.exitcode:
+                    sys.exit('{} failed at the {} scale'.format(name, scale_name))
+                runs.append(results.get())
+        finally:
+            if stop:
+                stop()
+        if check:
+            error = check()
+            if error:
+                sys.exit(error)
+    finally:
+        shutil.rmtree(temp_dir)
+    seconds, peak_kb = min(runs)
+    return collections.OrderedDict([
+        ('benchmark', name), ('scale', scale_name), ('items', items), ('unit', unit),
+        ('seconds', seconds), ('per_second', items / seconds), ('peak_kb', peak_kb)])
+
+
+def find_regressions(results, baseline, threshold):
+    """
+    Returns a message for each result that's slower, or takes more memory,
+    than the same benchmark and scale in a baseline by more than threshold
+    """
+    expected = {(result['benchmark'], result['scale']): result for result in baseline['results']}
+    messages = []
+    for result in results:
+        base = expected.get((result['benchmark'], result['scale']))
+        if base is None:
+            continue
+        name = '{} ({})'.format(result['benchmark'], result['scale'])
+        if result['per_second'] < base['per_second'] * (1 - threshold):
+            messages.append('{}: {:,.0f} {}/s, down from {:,.0f}'.format(
+                name, result['per_second'], result['unit'], base['per_second']))
+        growth = result['peak_kb'] - base['peak_kb']
+        if growth > MEMORY_NOISE_KB and growth > base['peak_kb'] * threshold:
+            messages.append('{}: peak memory +{:,} KB, up from +{:,} KB'.format(
+                name, result['peak_kb'], base['peak_kb']))
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--scales', nargs='+', choices=SCALES.keys(), default=['small', 'medium'],
+                        help='input sizes to run at (default: small medium)')
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS.keys(),
+                        default=BENCHMARKS.keys(), metavar='NAME',
+                        help='benchmarks to run (default: all of them)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='times to run each benchmark, keeping the fastest (default: 3)')
+    parser.add_argument('-o', '--output', help='write the results to a JSON file')
+    parser.add_argument('--save-baseline', metavar='FILENAME',
+                        help='write the results to a JSON file to compare later runs with')
+    parser.add_argument('--baseline', metavar='FILENAME',
+                        help='fail if the results are worse than those in a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='fraction worse than the baseline that counts as a regression '
+                             '(default: 0.25)')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = []
+    for scale_name in args.scales:
+        for name in args.benchmarks:
+            result = run_benchmark(name, scale_name, args.repeat)
+            results.append(result)
+            print '{:<28} {:<7} {:>10,} {:<6} {:>8.3f} s {:>12,.0f} {}/s  peak +{:,} KB'.format(
+                name, scale_name, result['items'], result['unit'], result['seconds'],
+                result['per_second'], result['unit'], result['peak_kb'])
+
+    report = collections.OrderedDict([
+        ('created', datetime.datetime.now().isoformat()),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('results', results)])
+    for filename in (args.output, args.save_baseline):
+        if filename:
+            with open(filename, 'w') as output:
+                json.dump(report, output, indent=2)
+
+    if baseline is not None:
+        regressions = find_regressions(results, baseline, args.threshold)
+        if regressions:
+            sys.exit('Regressions past {:.0%} of the baseline:\n{}'.format(
+                args.threshold, '\n'.join(regressions)))
+        print 'No regressions past {:.0%} of the baseline'.format(args.threshold)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+"""
+Optional instrumentation shared by the three scripts. Each script adds the
+repo root to sys.path, imports this module and adds its options to its
+parser. A run with --instrument, or with the INSTRUMENT environment
+variable set to 1, true or a prefix, wraps the script's hot functions
+with call counters and timers. At the end of the run it writes:
+- a collapsed stack file that flamegraph.pl and speedscope can read, and
+- a summary table for each function, which also goes to stderr.
+--cprofile, or INSTRUMENT_CPROFILE, also runs cProfile over the main
+thread. Nothing is wrapped unless instrumentation is asked for, so a
+normal run is no slower. Running this module runs its tests.
+"""
+import contextlib
+import os
+import sys
+import threading
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # Python 2 without the backport, so peak RSS is used instead
+
+ENV_VARIABLE = 'INSTRUMENT'  # Set to a prefix for the output files, or to 1
+CPROFILE_ENV_VARIABLE = 'INSTRUMENT_CPROFILE'
+OFF_VALUES = ('', '0', 'false', 'no')
+ON_VALUES = ('1', 'true')
+
+
+def environment_prefix(environ=os.environ):
+    """
+    Returns the prefix INSTRUMENT asks for: None when it's unset or off, ''
+    for the script name when it's just on, or else the prefix it's set to
+    """
+    value = environ.get(ENV_VARIABLE, '').strip()
+    if value.lower() in OFF_VALUES:
+        return None
+    return '' if value.lower() in ON_VALUES else value
+
+
+def environment_flag(name, environ=os.environ):
+    "Returns whether an environment variable is set to anything but an off value"
+    return environ.get(name, '').strip().lower() not in OFF_VALUES
+
+
+def add_arguments(parser):
+    "Adds the instrumentation options to an argparse parser"
+    group = parser.add_argument_group('instrumentation')
+    group.add_argument('--instrument', nargs='?', const='', metavar='PREFIX',
+                       default=environment_prefix(),
+                       help='count and time the hot functions, writing PREFIX.folded and '
+                            'PREFIX.txt (default PREFIX: the script name; also set by '
+                            '${})'.format(ENV_VARIABLE))
+    group.add_argument('--cprofile', action='store_true',
+                       default=environment_flag(CPROFILE_ENV_VARIABLE),
+                       help='with --instrument, also run cProfile, writing PREFIX.prof '
+                            '(also set by ${})'.format(CPROFILE_ENV_VARIABLE))
+
+
+class Instrumentation():
+    """
+    Counts and times calls to wrapped functions. Each thread keeps a stack
+    of the wrapped calls it's in, and totals calls, inclusive seconds and
+    self seconds for each stack, as a ;-separated path from a root frame
+    named name. Totals are only merged when reporting, so a wrapped call
+    costs two timer reads and a few list operations, without locking
+    """
+    def __init__(self, name, prefix=None, use_cprofile=False):
+        self.name = name
+        self.prefix = prefix or name
+        self.use_cprofile = use_cprofile
+        self.patched = []  # (owner, attribute, original) of each wrapped function
+        self.local = threading.local()
+        self.thread_totals = []  # The totals dict of every thread that made a wrapped call
+        self.lock = threading.Lock()
+        self.profiler = None
+        self.started = None
+        self.seconds = None
+
+    def thread_stack(self):
+        "Starts this thread's stack and totals"
+        self.local.stack = [[self.name, 0.0]]
+        self.local.totals = totals = {}
+        with self.lock:
+            self.thread_totals.append(totals)
+        return self.local.stack
+
+    def wrap(self, owner, attribute, label=None):
+        """
+        Replaces a function on a module or class with one that counts and
+        times its calls, under label, or the attribute's name
+        """
+        original = owner.__dict__[attribute]
+        function = getattr(owner, attribute)
+        label = label or attribute
+        local, timer = self.local, timeit.default_timer
+        thread_stack = self.thread_stack
+
+        def wrapper(*args, **kwargs):
+            try:
+                stack = local.stack
+            except AttributeError:
+                stack = thread_stack()
+            path = stack[-1][0] + ';' + label
+            frame = [path, 0.0]  # Path and seconds spent in wrapped calls from this one
+            stack.append(frame)
+            start = timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = timer() - start
+                stack.pop()
+                stack[-1][1] += seconds
+                totals = local.totals.get(path)
+                if totals is None:
+                    totals = local.totals[path] = [0, 0.0, 0.0]
+                totals[0] += 1
+                totals[1] += seconds
+                totals[2] += seconds - frame[1]
+
+        wrapper.__name__ = getattr(function, '__name__', attribute)
+        wrapper.__doc__ = getattr(function, '__doc__', None)
+        setattr(owner, attribute, wrapper)
+        self.patched.append((owner, attribute, original))
+
+    def start(self, targets=()):
+        """
+        Wraps each (owner, attribute) or (owner, attribute, label) in
+        targets, and starts timing the run
+        """
+        for target in targets:
+            self.wrap(*target)
+        if tracemalloc is not None:
+            tracemalloc.start()
+        if self.use_cprofile:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.started = timeit.default_timer()
+        return self
+
+    def stop(self):
+        "Puts back the wrapped functions and writes the reports"
+        self.seconds = timeit.default_timer() - self.started
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.prefix + '.prof')
+        for owner, attribute, original in reversed(self.patched):
+            setattr(owner, attribute, original)
+        self.patched = []
+        with open(self.prefix + '.folded', 'w') as folded:
+            folded.write(self.collapsed_stacks())
+        summary = self.summary()
+        with open(self.prefix + '.txt', 'w') as summary_file:
+            summary_file.write(summary)
+        sys.stderr.write(summary)
+        if tracemalloc is not None:
+            tracemalloc.stop()
+
+    def stack_totals(self):
+        "Returns the calls, inclusive seconds and self seconds of each stack, over every thread"
+        with self.lock:
+            thread_totals = list(self.thread_totals)
+        result = {}
+        for totals in thread_totals:
+            for path, (calls, seconds, self_seconds) in totals.items():
+                merged = result.setdefault(path, [0, 0.0, 0.0])
+                merged[0] += calls
+                merged[1] += seconds
+                merged[2] += self_seconds
+        return result
+
+    def collapsed_stacks(self):
+        """
+        Returns the self time of each stack in microseconds, in the
+        collapsed format, with the rest of the run's time under the root
+        """
+        totals = self.stack_totals()
+        lines = []
+        outside = self.seconds
+        for path, (calls, seconds, self_seconds) in sorted(totals.items()):
+            if path.count(';') == 1:
+                outside -= seconds  # Threads' time can overlap, so this is only a guide
+            lines.append('{} {}\n'.format(path, int(self_seconds * 1e6)))
+        lines.insert(0, '{} {}\n'.format(self.name, max(0, int(outside * 1e6))))
+        return ''.join(lines)
+
+    def peak_memory(self):
+        "Returns the peak memory use in KB, and how it was measured"
+        if tracemalloc is not None:
+            return tracemalloc.get_traced_memory()[1] // 1024, 'traced'
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            peak //= 1024  # Bytes rather than KB
+        return peak, 'max RSS'
+
+    def summary(self):
+        "Returns a table of the calls and time in each wrapped function, slowest first"
+        functions = {}
+        for path, (calls, seconds, self_seconds) in self.stack_totals().items():
+            frames = path.split(';')
+            totals = functions.setdefault(frames[-1], [0, 0.0, 0.0])
+            totals[0] += calls
+            if frames[-1] not in frames[:-1]:  # Recursive calls are already counted
+                totals[1] += seconds
+            totals[2] += self_seconds
+        peak, measure = self.peak_memory()
+        lines = ['{}: {:.3f} s, peak memory {:,} KB ({})'.format(
+                     self.name, self.seconds, peak, measure),
+                 '{:<36} {:>12} {:>10} {:>10} {:>10} {:>7}'.format(
+                     'function', 'calls', 'total s', 'self s', 'mean us', 'of run')]
+        for label, (calls, seconds, self_seconds) in sorted(
+                functions.items(), key=lambda item: -item[1][1]):
+            lines.append('{:<36} {:>12,} {:>10.3f} {:>10.3f} {:>10.2f} {:>6.1%}'.format(
+                label, calls, seconds, self_seconds, seconds * 1e6 / calls,
+                seconds / self.seconds if self.seconds else 0.0))
+        if len(self.thread_totals) > 1:
+            lines.append('Times from {} threads are added up, so can come to more than '
+                         'the run'.format(len(self.thread_totals)))
+        if self.profiler:
+            lines.append('cProfile stats of the main thread written to {}.prof'.format(
+                self.prefix))
+        return '\n'.join(lines) + '\n'
+
+
+@contextlib.contextmanager
+def instrumented(args, name, targets):
+    """
+    Wraps targets, as for Instrumentation.start, for the length of the
+    block if args from a parser given add_arguments ask for it, and
+    reports at the end. Yields the Instrumentation, or None
+    """
+    if args.instrument is None:
+        yield None
+        return
+    session = Instrumentation(name, args.instrument, args.cprofile).start(targets)
+    try:
+        yield session
+    finally:
+        session.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+    import shutil
+    import tempfile
+    import unittest
+
+    class Counted():
+        "Stands in for a script's class with hot functions"
+        def step(self):
+            return 1
+
+        def run(self, steps):
+            return sum(self.step() for _ in range(steps))
+
+    class InstrumentationTest(unittest.TestCase):
+        def test_counts_calls_and_puts_functions_back(self):
+            step = Counted.__dict__['step']
+            temp_dir = tempfile.mkdtemp()
+            stderr = sys.stderr
+            try:
+                session = Instrumentation('counted', os.path.join(temp_dir, 'counted'))
+                session.start([(Counted, 'step', 'Counted.step'), (Counted, 'run', 'Counted.run')])
+                counted = Counted()
+                for _ in range(3):
+                    counted.step()
+                self.assertEqual(counted.run(4), 4)
+                sys.stderr = open(os.devnull, 'w')
+                session.stop()
+                with open(os.path.join(temp_dir, 'counted.folded')) as folded:
+                    stacks = dict(line.rsplit(' ', 1) for line in folded.read().splitlines())
+                self.assertEqual(sorted(stacks), ['counted', 'counted;Counted.run',
+                                                  'counted;Counted.run;Counted.step',
+                                                  'counted;Counted.step'])
+                with open(os.path.join(temp_dir, 'counted.txt')) as summary:
+                    counts = dict(line.split()[:2] for line in summary.read().splitlines()[2:])
+                self.assertEqual(counts, {'Counted.step': '7', 'Counted.run': '1'})
+            finally:
+                sys.stderr = stderr
+                shutil.rmtree(temp_dir)
+            self.assertIs(Counted.__dict__['step'], step)
+
+        def test_environment_switches(self):
+            for value, prefix in [(None, None), ('', None), ('0', None), ('false', None),
+                                  ('No', None), (' 1 ', ''), ('TRUE', ''), ('runs/csv', 'runs/csv')]:
+                environ = {} if value is None else {ENV_VARIABLE: value}
+                self.assertEqual(environment_prefix(environ), prefix)
+                self.assertEqual(environment_flag(ENV_VARIABLE, environ), prefix is not None)
+
+        def test_arguments(self):
+            parser = argparse.ArgumentParser()
+            add_arguments(parser)
+            self.assertEqual(parser.parse_args(['--instrument']).instrument, '')
+            self.assertEqual(parser.parse_args(['--instrument', 'out']).instrument, 'out')
+            with instrumented(parser.parse_args([]), 'counted', [(Counted, 'step')]) as session:
+                self.assertIsNone(session)
+                self.assertIs(Counted.step.__func__, Counted.__dict__['step'])
+
+    unittest.main()
@@ -1,14 +1,147 @@
-class Rover():
-    def __init__(self, x, y, facing):
+import array
+import bisect
+import collections
+import heapq
+import itertools
+import re
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # Only needed by simulate_batch
+
+# Headings as integers, clockwise from north, so turning right adds one and
+# turning left takes one, mod 4
+HEADINGS = 'NESW'
+HEADING_INDEX = {facing: heading for heading, facing in enumerate(HEADINGS)}
+DX = (0, 1, 0, -1)  # Change in x of a move, by heading
+DY = (1, 0, -1, 0)  # Change in y of a move, by heading
+TURN_LEFT = (3, 0, 1, 2)  # Heading after turning left, by heading
+TURN_RIGHT = (1, 2, 3, 0)  # Heading after turning right, by heading
+
+EDGE_MESSAGE = 'Movement failed, cannot move rover off the edge of the plateau'
+NEGATIVE_MESSAGE = 'Movement failed, cannot move to negative coordinates'
+ROVER_MESSAGE = 'Movement failed, cannot move onto another rover'
+COLLISION_MESSAGE = 'Collision with another rover at {} {}'
+BLOCKED_MESSAGES = {'edge': EDGE_MESSAGE, 'negative': NEGATIVE_MESSAGE, 'rover': ROVER_MESSAGE}
+
+COMMAND_RUN_RE = re.compile('([LR]*)(M*)')
+INVALID_COMMAND_RE = re.compile('[^LRM]')
+
+
+def compile_commands(commands):
+    """
+    Compiles a string of L, R and M commands into a list of (turns, moves)
+    pairs, each a net number of right turns, mod 4, followed by a number of
+    moves forward. Returns the list along with the first command that isn't
+    L, R or M, or None if they all are. Only the commands before that one
+    are compiled
+    """
+    invalid = INVALID_COMMAND_RE.search(commands)
+    if invalid:
+        commands = commands[:invalid.start()]
+    program = []
+    for turns, moves in COMMAND_RUN_RE.findall(commands):
+        net_turns = (turns.count('R') - turns.count('L')) % 4
+        if net_turns or moves:
+            program.append((net_turns, len(moves)))
+    return program, invalid.group() if invalid else None
+
+
+def write_messages(message, count):
+    "Prints a message count times, in one write"
+    if count:
+        sys.stdout.write((message + '\n') * count)
+
+
+class Fleet():
+    """
+    Stores the positions and headings of many rovers in typed parallel
+    arrays, a few bytes per rover, rather than as an object each. Rovers are
+    numbered by when they were added, and read and changed through Rover
+    views
+    """
+    def __init__(self):
+        self.xs = array.array('l')
+        self.ys = array.array('l')
+        self.headings = array.array('b')
+
+    def __len__(self):
+        return len(self.headings)
+
+    def add(self, x, y, heading):
+        "Adds a rover and returns its index"
+        self.xs.append(x)
+        self.ys.append(y)
+        self.headings.append(heading)
+        return len(self.headings) - 1
+
+    def format_positions(self, start=0, stop=None):
+        "Returns the positions of a range of rovers as lines of 'x y facing'"
+        stop = len(self) if stop is None else stop
+        facings = itertools.imap(HEADINGS.__getitem__, self.headings[start:stop])
+        lines = itertools.imap('{} {} {}\n'.format, self.xs[start:stop], self.ys[start:stop],
+                               facings)
+        return ''.join(lines)
+
+
+class Rover(object):
+    """
+    A rover, as a view over its place in a Fleet. Without a fleet, it's
+    given one of its own
+    """
+    __slots__ = ('fleet', 'index')
+
+    def __init__(self, x, y, facing, fleet=None):
         if all(coord >= 0 for coord in [x, y]):
-            self.x = int(x)
-            self.y = int(y)
+            x, y = int(x), int(y)
         else:
             raise ValueError('Cannot initiate a rover with negative coordinates')
-        self.facing = facing.upper()
-        self.left = {'N': 'W', 'W': 'S', 'S': 'E', 'E': 'N'}
-        self.right = {'N': 'E', 'E': 'S', 'S': 'W', 'W': 'N'}
-        self.move = {'N': [0, 1], 'E': [1, 0], 'S': [0, -1], 'W': [-1, 0]}
+        if facing.upper() not in HEADING_INDEX:
+            raise ValueError('Cannot initiate a rover facing {}'.format(facing))
+        self.fleet = Fleet() if fleet is None else fleet
+        self.index = self.fleet.add(x, y, HEADING_INDEX[facing.upper()])
+
+    def __eq__(self, other):
+        return (isinstance(other, Rover) and self.fleet is other.fleet and
+                self.index == other.index)
+
+    def __ne__(self, other):
+        return not self == other
+
+    @property
+    def x(self):
+        return self.fleet.xs[self.index]
+
+    @x.setter
+    def x(self, x):
+        self.fleet.xs[self.index] = x
+
+    @property
+    def y(self):
+        return self.fleet.ys[self.index]
+
+    @y.setter
+    def y(self, y):
+        self.fleet.ys[self.index] = y
+
+    @property
+    def heading(self):
+        "The rover's facing as an index into HEADINGS"
+        return self.fleet.headings[self.index]
+
+    @heading.setter
+    def heading(self, heading):
+        self.fleet.headings[self.index] = heading
+
+    @property
+    def facing(self):
+        return HEADINGS[self.heading]
+
+    @facing.setter
+    def facing(self, facing):
+        self.heading = HEADING_INDEX[facing]
 
     def get_position(self):
         "Return the position of the rover as a dictionary"
@@ -19,10 +152,8 @@ class Rover():
         Returns the coordinates that the rover would move to if it did move.
         Use this to make sure rovers aren't running off of the plateau
         """
-        movement = self.move[self.facing]
-        x = self.x + movement[0]
-        y = self.y + movement[1]
-        return [x, y]
+        heading = self.heading
+        return [self.x + DX[heading], self.y + DY[heading]]
 
     def move_forward(self):
         """
@@ -35,26 +166,386 @@ class Rover():
         if all(coord >= 0 for coord in new_position):
             self.x, self.y = new_position
         else:
-            print 'Movement failed, cannot move to negative coordinates'
+            print NEGATIVE_MESSAGE
 
     def turn_left(self):
         "Turns the rover 90 degrees to the left"
-        self.facing = self.left[self.facing]
+        self.heading = TURN_LEFT[self.heading]
 
     def turn_right(self):
         "Turns the rover 90 degrees to the right"
-        self.facing = self.right[self.facing]
+        self.heading = TURN_RIGHT[self.heading]
+
+
+class RoverList(collections.Sequence):
+    "A read only list of Rover views over a range of a Fleet"
+    def __init__(self, fleet, start, stop):
+        self.fleet = fleet
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('rover index out of range')
+        rover = Rover.__new__(Rover)
+        rover.fleet, rover.index = self.fleet, self.start + index
+        return rover
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class OccupancyIndex():
+    """
+    Records which cells of a width by height grid have rovers on them, for
+    O(1) collision checks. Cells are packed into integers, y * width + x, and
+    kept in a set while there are few rovers. Once the set would take more
+    memory than a bitset of the whole grid, they're moved into one, so memory
+    grows with the number of rovers or the size of the grid, whichever is
+    smaller. Cells outside the grid are never occupied. Cells with more than
+    one rover on them are counted in stacked
+    """
+    set_entry_bytes = 64  # Roughly what a packed cell costs in a set
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.cells = set()
+        self.bits = None  # A bytearray with a bit per cell, once cells is too big
+        self.stacked = {}  # Cells with more than one rover, and how many more
+        self.count = 0  # Rovers in the index
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def has_cell(self, cell):
+        if self.bits is None:
+            return cell in self.cells
+        return self.bits[cell >> 3] & (1 << (cell & 7)) != 0
+
+    def is_occupied(self, x, y):
+        "Returns whether there's a rover on a cell"
+        return self.in_bounds(x, y) and self.has_cell(y * self.width + x)
+
+    def add(self, x, y):
+        "Records a rover on a cell"
+        if not self.in_bounds(x, y):
+            return
+        cell = y * self.width + x
+        self.count += 1
+        if self.has_cell(cell):
+            self.stacked[cell] = self.stacked.get(cell, 0) + 1
+        elif self.bits is None:
+            self.cells.add(cell)
+            if len(self.cells) * self.set_entry_bytes > self.width * self.height // 8:
+                self.use_bitset()
+        else:
+            self.bits[cell >> 3] |= 1 << (cell & 7)
+
+    def remove(self, x, y):
+        "Records a rover leaving a cell"
+        if not self.in_bounds(x, y):
+            return
+        cell = y * self.width + x
+        self.count -= 1
+        if cell in self.stacked:
+            self.stacked[cell] -= 1
+            if not self.stacked[cell]:
+                del self.stacked[cell]
+        elif self.bits is None:
+            self.cells.discard(cell)
+        else:
+            self.bits[cell >> 3] &= ~(1 << (cell & 7)) & 0xff
+
+    def move(self, old_x, old_y, x, y):
+        self.remove(old_x, old_y)
+        self.add(x, y)
+
+    def use_bitset(self):
+        "Moves the occupied cells from the set into a bitset of the grid"
+        bits = bytearray((self.width * self.height + 7) // 8)
+        for cell in self.cells:
+            bits[cell >> 3] |= 1 << (cell & 7)
+        self.bits = bits
+        self.cells = set()
+
+
+BIT_COUNTS = [bin(byte).count('1') for byte in range(256)]
+
+
+class CompressedBitmap():
+    """
+    A set of non-negative integers, like packed cells, split into containers
+    of 2 ** 16 by their high bits. A container is a sorted array of the low
+    bits of its members while it has few of them, and a bitset of 8 KB once
+    it has more than array_limit, so sparse and dense regions both take
+    little memory
+    """
+    array_limit = 4096
+    container_bits = 16
+
+    def __init__(self):
+        self.containers = {}
+
+    def add(self, value):
+        high, low = value >> self.container_bits, value & 0xffff
+        container = self.containers.get(high)
+        if container is None:
+            self.containers[high] = array.array('H', [low])
+        elif isinstance(container, bytearray):
+            container[low >> 3] |= 1 << (low & 7)
+        else:
+            index = bisect.bisect_left(container, low)
+            if index == len(container) or container[index] != low:
+                container.insert(index, low)
+                if len(container) > self.array_limit:
+                    bits = bytearray(1 << (self.container_bits - 3))
+                    for member in container:
+                        bits[member >> 3] |= 1 << (member & 7)
+                    self.containers[high] = bits
+
+    def __contains__(self, value):
+        high, low = value >> self.container_bits, value & 0xffff
+        container = self.containers.get(high)
+        if container is None:
+            return False
+        if isinstance(container, bytearray):
+            return container[low >> 3] & (1 << (low & 7)) != 0
+        index = bisect.bisect_left(container, low)
+        return index < len(container) and container[index] == low
+
+    def __len__(self):
+        return sum(len(container) if isinstance(container, array.array)
+                   else sum(itertools.imap(BIT_COUNTS.__getitem__, container))
+                   for container in self.containers.values())
+
+    def nbytes(self):
+        "Returns roughly how many bytes the containers take"
+        return sum(len(container) * (container.itemsize if isinstance(container, array.array)
+                                     else 1)
+                   for container in self.containers.values())
+
+
+class Trajectory():
+    """
+    A rover's recorded commands, one byte each, with a checkpoint of its
+    position and heading, and the offset into its commands, every so many
+    steps
+    """
+    __slots__ = ('commands', 'xs', 'ys', 'headings', 'offsets')
+
+    def __init__(self):
+        self.commands = bytearray()
+        self.xs = array.array('l')
+        self.ys = array.array('l')
+        self.headings = array.array('b')
+        self.offsets = array.array('l')
+
+    def checkpoint(self, x, y, heading):
+        self.xs.append(x)
+        self.ys.append(y)
+        self.headings.append(heading)
+        self.offsets.append(len(self.commands))
+
+
+def clip_segment(start, end, highest):
+    """
+    Clips a run of coordinates from start to end to 0 to highest, keeping
+    its direction, and returns the new start and end, or None, None if
+    none of it is left
+    """
+    low, high = max(min(start, end), 0), min(max(start, end), highest)
+    if low > high:
+        return None, None
+    return (low, high) if start <= end else (high, low)
+
+
+class TrajectoryRecorder():
+    """
+    Records where the rovers on a plateau go, so that where a rover was at
+    any step can be found by replaying at most checkpoint_every steps from
+    its last checkpoint before then, and which rovers ever visited a cell can
+    be looked up. Rovers are numbered in the order they're created. The
+    packed cells each rover visits are kept in a CompressedBitmap, and every
+    visited cell in another, the coverage. Cells outside the plateau aren't
+    recorded. Give it to a Plateau to start recording.
+
+    Rovers move one after another, so while a rover was moving, the rovers
+    created before it were already where they are now, and those after it
+    weren't there yet. Replays on a plateau that blocks collisions put the
+    earlier rovers back in the way, so they're blocked just the same
+    """
+    def __init__(self, checkpoint_every=1024):
+        self.checkpoint_every = checkpoint_every
+        self.plateau = None
+        self.trajectories = []
+        self.visited = []  # A CompressedBitmap of the cells each rover visited
+        self.coverage = CompressedBitmap()
+
+    def attach(self, plateau):
+        self.plateau = plateau
+        self.width = plateau.far_right + 1
+
+    def add_rover(self, x, y, heading):
+        "Starts the trajectory of a newly created rover"
+        trajectory = Trajectory()
+        trajectory.checkpoint(x, y, heading)
+        self.trajectories.append(trajectory)
+        self.visited.append(CompressedBitmap())
+        self.visit_segment(x, y, x, y)
+
+    def visit_segment(self, x, y, end_x, end_y):
+        """
+        Records the current rover visiting the cells on a straight line from
+        x, y to end_x, end_y. Only the part of the line on the plateau is
+        recorded, since a rover can start just off the plateau and move on
+        """
+        plat = self.plateau
+        if x == end_x:
+            if not 0 <= x <= plat.far_right:
+                return
+            y, end_y = clip_segment(y, end_y, plat.top)
+            if y is None:
+                return
+        else:
+            if not 0 <= y <= plat.top:
+                return
+            x, end_x = clip_segment(x, end_x, plat.far_right)
+            if x is None:
+                return
+        step = (end_x > x) - (end_x < x) + ((end_y > y) - (end_y < y)) * self.width
+        cell, end = y * self.width + x, end_y * self.width + end_x
+        add, add_coverage = self.visited[-1].add, self.coverage.add
+        for cell in xrange(cell, end + step, step) if step else [cell]:
+            add(cell)
+            add_coverage(cell)
+
+    def run_commands(self, commands):
+        """
+        Runs commands on the plateau's current rover like
+        Plateau.run_commands, recording them, the cells the rover visits,
+        and a checkpoint at every checkpoint_every steps
+        """
+        plat = self.plateau
+        invalid = INVALID_COMMAND_RE.search(commands)
+        if invalid:
+            commands = commands[:invalid.start()]
+        if commands:
+            plat.rover_check()
+        trajectory = self.trajectories[-1]
+        start = 0
+        while start < len(commands):
+            # Run up to the next checkpoint at a time
+            steps = self.checkpoint_every - len(trajectory.commands) % self.checkpoint_every
+            piece = commands[start:start + steps]
+            plat.execute(compile_commands(piece)[0], self.visit_segment)
+            trajectory.commands.extend(piece)
+            start += len(piece)
+            if len(trajectory.commands) % self.checkpoint_every == 0:
+                trajectory.checkpoint(plat.rover.x, plat.rover.y, plat.rover.heading)
+        if invalid:
+            raise KeyError(invalid.group())
+
+    def steps(self, rover_number):
+        "Returns how many commands a rover has run"
+        return len(self.trajectories[rover_number].commands)
+
+    def position_at(self, rover_number, step):
+        """
+        Returns the position of a rover after its first step commands, as a
+        dictionary like Rover.get_position
+        """
+        trajectory = self.trajectories[rover_number]
+        if not 0 <= step <= len(trajectory.commands):
+            raise IndexError('rover {} has no step {}'.format(rover_number, step))
+        index = bisect.bisect_right(trajectory.offsets, step) - 1
+        offset = trajectory.offsets[index]
+        position = {'x': trajectory.xs[index], 'y': trajectory.ys[index],
+                    'facing': HEADINGS[trajectory.headings[index]]}
+        if step == offset:
+            return position
+        plat = self.plateau
+        commands = str(trajectory.commands[offset:step])
+        replay = Plateau(plat.far_right, plat.top,
+                         'block' if plat.collisions == 'block' else None, quiet=True)
+        if replay.occupancy is not None:
+            # Rovers aren't forgotten while collisions are checked, so their
+            # numbers are their places in the fleet. Only the rovers within
+            # the replay's reach can be in its way
+            reach = len(commands)
+            for x, y in itertools.islice(itertools.izip(plat.fleet.xs, plat.fleet.ys),
+                                         rover_number):
+                if abs(x - position['x']) + abs(y - position['y']) <= reach:
+                    replay.occupancy.add(x, y)
+        replay.create_rover(position['x'], position['y'], position['facing'])
+        replay.run_commands(commands)
+        return replay.rover.get_position()
+
+    def rovers_visiting(self, x, y):
+        """
+        Returns the numbers of the rovers that have been on a cell, in order.
+        A cell nobody visited is ruled out by the coverage bitmap at once,
+        but otherwise every rover's bitmap is checked, so this takes time
+        in proportion to the number of rovers. A cell to rovers index would
+        answer in proportion to the rovers found, but would cost an object
+        per visited cell, far more memory than the bitmaps for long
+        trajectories. bench_rover_trajectory.py times this for growing
+        numbers of rovers
+        """
+        if not 0 <= x <= self.plateau.far_right or not 0 <= y <= self.plateau.top:
+            return []
+        cell = y * self.width + x
+        if cell not in self.coverage:
+            return []
+        return [rover for rover, visited in enumerate(self.visited) if cell in visited]
 
 
 class Plateau():
-    def __init__(self, x, y):
+    """
+    A plateau for rovers to move around on, from 0, 0 to x, y. If collisions
+    is 'block' or 'report', an OccupancyIndex of the rovers is kept, and a
+    rover moving onto another one is stopped or allowed with a message.
+    Otherwise rovers don't notice each other. Blocked moves are counted in
+    blocked_moves, by their kind in BLOCKED_MESSAGES, and when quiet their
+    messages and those for collisions aren't printed. Given a
+    TrajectoryRecorder, every rover's commands and moves are recorded.
+    version goes up whenever a rover is created, moved or forgotten, so
+    anything worked out from where the rovers are, like a PathPlanner's
+    distance fields, can tell when it's out of date
+    """
+    def __init__(self, x, y, collisions=None, quiet=False, recorder=None):
         if all(coord >= 0 for coord in [x, y]):
             self.far_right = int(x)
             self.top = int(y)
-            self.retired_rovers = []
+            self.fleet = Fleet()  # Every rover, retired or active, in order
+            self.retired_count = 0  # How many rovers at the start of fleet are retired
+            self.forgotten = 0  # How many retired rovers drop_retired has taken out of fleet
             self.rover = False
         else:
             raise ValueError('Cannot initiate a plateau with negative coordinates')
+        if collisions not in (None, 'block', 'report'):
+            raise ValueError("collisions must be None, 'block' or 'report'")
+        self.collisions = collisions
+        self.collision_count = 0
+        self.quiet = quiet
+        self.blocked_moves = collections.Counter()
+        self.version = 0
+        self.recorder = recorder
+        if recorder:
+            recorder.attach(self)
+        self.occupancy = None
+        if collisions:
+            self.occupancy = OccupancyIndex(self.far_right + 1, self.top + 1)
 
     def create_rover(self, x, y, facing):
         """
@@ -63,9 +554,51 @@ class Plateau():
         """
         x, y = int(x), int(y)
         facing = facing.upper()
+        occupancy = self.occupancy
+        if occupancy and occupancy.is_occupied(x, y):
+            if self.collisions == 'block':
+                self.collision_count += 1
+                raise ValueError('Cannot create a rover on top of another rover')
+            self.report_collision(x, y)
+        self.rover = Rover(x, y, facing, self.fleet)
+        self.retired_count = self.rover.index
+        self.version += 1
+        if occupancy:
+            occupancy.add(x, y)
+        if self.recorder:
+            self.recorder.add_rover(x, y, self.rover.heading)
+
+    @property
+    def retired_rovers(self):
+        return RoverList(self.fleet, 0, self.retired_count)
+
+    def drop_retired(self):
+        """
+        Forgets the retired rovers, to save memory once they've been written
+        out. Views of them stop working. The rovers are needed for collision
+        checks, so they can't be forgotten then
+        """
+        if self.occupancy is not None:
+            raise ValueError('Cannot forget rovers while checking for collisions')
+        count = self.retired_count
+        for values in (self.fleet.xs, self.fleet.ys, self.fleet.headings):
+            del values[:count]
+        self.retired_count = 0
+        self.forgotten += count
+        self.version += 1
         if self.rover:
-            self.retired_rovers.append(self.rover)
-        self.rover = Rover(x, y, facing)
+            self.rover.index -= count
+
+    def blocked(self, kind, count=1):
+        "Counts moves blocked for a reason in BLOCKED_MESSAGES, printing their messages"
+        self.blocked_moves[kind] += count
+        if not self.quiet:
+            write_messages(BLOCKED_MESSAGES[kind], count)
+
+    def report_collision(self, x, y):
+        self.collision_count += 1
+        if not self.quiet:
+            print COLLISION_MESSAGE.format(x, y)
 
     def rover_check(self):
         "Makes sure the current rover exists"
@@ -77,41 +610,656 @@ class Plateau():
         or right edges of the plateau. Doesn't move the rover if it would cause it to
         fall off of the plateau
         """
+        if self.recorder:
+            self.run_commands('M')
+            return
         self.rover_check()
         next_position = self.rover.get_next_position_if_moved()
         # Make sure the next position isn't off of the top or right edges of the plateau
         if next_position[0] > self.far_right or next_position[1] > self.top:
-            print 'Movement failed, cannot move rover off the edge of the plateau'
+            self.blocked('edge')
+            return
+        # Checked here as well as in Rover.move_forward, so it can be counted
+        if next_position[0] < 0 or next_position[1] < 0:
+            self.blocked('negative')
             return
+        occupancy = self.occupancy
+        if occupancy is None:
+            self.rover.move_forward()
+            self.version += 1
+            return
+
+        if occupancy.is_occupied(*next_position):
+            if self.collisions == 'block':
+                self.collision_count += 1
+                self.blocked('rover')
+                return
+            self.report_collision(*next_position)
+        x, y = self.rover.x, self.rover.y
         self.rover.move_forward()
+        self.version += 1
+        occupancy.move(x, y, self.rover.x, self.rover.y)
+
+    def run_commands(self, commands):
+        """
+        Runs a string of L, R and M commands on the current rover, with the
+        same results and messages as calling turn_rover_left,
+        turn_rover_right and move_rover for each one. The string is compiled
+        first, so each run of turns takes one step, and so does each run of
+        moves, clamped to the plateau in one go. A command other than L, R
+        or M raises a KeyError once the commands before it have run
+        """
+        if self.recorder:
+            self.recorder.run_commands(commands)
+            return
+        program, invalid = compile_commands(commands)
+        if program:
+            self.rover_check()
+            self.execute(program)
+        if invalid:
+            raise KeyError(invalid)
+
+    def execute(self, program, on_move=None):
+        """
+        Runs a program from compile_commands on the current rover. If given,
+        on_move is called with where each run of moves started and ended
+        """
+        rover = self.rover
+        heading = rover.heading
+        x, y = rover.x, rover.y
+        for turns, moves in program:
+            heading = (heading + turns) % 4
+            if moves:
+                end_x, end_y = self.run_moves(x, y, heading, moves)
+                if on_move:
+                    on_move(x, y, end_x, end_y)
+                x, y = end_x, end_y
+        rover.x, rover.y, rover.heading = x, y, heading
+        self.version += 1
+
+    def run_moves(self, x, y, heading, moves):
+        """
+        Moves a rover at x, y facing heading forward moves times, printing a
+        message for each blocked move like move_rover, and returns where it
+        ends up. Without collision checks this takes constant time
+        """
+        dx, dy = DX[heading], DY[heading]
+        if dx:
+            position, step, bound, across, across_bound = x, dx, self.far_right, y, self.top
+        else:
+            position, step, bound, across, across_bound = y, dy, self.top, x, self.far_right
+        # move_rover fails on a next position past the top or right edge,
+        # then Rover.move_forward on one below zero
+        edge_blocked = negative_blocked = 0
+        if across > across_bound or position + step > bound:
+            edge_blocked = moves
+        elif step > 0:
+            edge_blocked = max(0, moves - (bound - position))
+        else:
+            negative_blocked = max(0, moves - position)
+        moved = moves - edge_blocked - negative_blocked
+
+        occupancy = self.occupancy
+        if occupancy is not None and moved:
+            for distance in xrange(1, moved + 1):
+                cell_x, cell_y = x + dx * distance, y + dy * distance
+                if occupancy.is_occupied(cell_x, cell_y):
+                    if self.collisions == 'block':
+                        # Stuck behind the rover for the rest of the moves
+                        self.collision_count += moves - distance + 1
+                        self.blocked('rover', moves - distance + 1)
+                        moved = distance - 1
+                        edge_blocked = negative_blocked = 0
+                        break
+                    self.report_collision(cell_x, cell_y)
+            occupancy.move(x, y, x + dx * moved, y + dy * moved)
+
+        if edge_blocked:
+            self.blocked('edge', edge_blocked)
+        if negative_blocked:
+            self.blocked('negative', negative_blocked)
+        return x + dx * moved, y + dy * moved
 
     def turn_rover_left(self):
         "Turns the current rover 90 degrees to the left"
+        if self.recorder:
+            self.run_commands('L')
+            return
         self.rover_check()
         self.rover.turn_left()
 
     def turn_rover_right(self):
         "Turns the current rover 90 degrees to the right"
+        if self.recorder:
+            self.run_commands('R')
+            return
         self.rover_check()
         self.rover.turn_right()
 
     def print_rovers(self):
         "Prints the position of each rover formatted to the expected output."
         if self.rover:
-            self.retired_rovers.append(self.rover)
-        for rover in self.retired_rovers:
-            position = rover.get_position()
-            print "{} {} {}".format(position['x'], position['y'], position['facing'])
+            self.retired_count = len(self.fleet)
+        sys.stdout.write(self.fleet.format_positions(0, self.retired_count))
+
+
+# Fewest turns between two headings, by heading and heading
+TURN_COUNTS = tuple(tuple(min((b - a) % 4, (a - b) % 4) for b in range(4)) for a in range(4))
+UNREACHED = 2 ** 31 - 1  # Distance of a state that can't reach a distance field's target
 
 
-def main():
+class PathPlanner():
+    """
+    Plans the cheapest command string to get a rover from one position and
+    heading to another on a plateau, without going through a cell another
+    rover is on. A move costs 1 and a turn costs turn_cost, so with the
+    default of 1 the plan is the shortest string. States are packed into
+    integers, cell * 4 + heading, with cells packed like OccupancyIndex.
+
+    Plans are found with an A* search, estimating the cost left from a state
+    as what it would be with no rovers in the way. Once a target has been
+    asked for field_after times, its distance field, the cost from every
+    state to it, is worked out with a search back from the target and
+    cached, so later plans to it just walk down the field. Up to max_fields
+    fields are kept, the least recently used going first. A field takes
+    four integers a state, so on plateaus of more than max_field_cells
+    cells, plans always use A*.
+
+    Rovers are looked up in the plateau's OccupancyIndex, or without one,
+    in an index of the planner's own. Only the plateau's current rover
+    moves, and new rovers are added after it, so when the plateau's
+    version changes, only the last rover seen and any after it are looked
+    at to find the cells rovers have left or moved onto. A field that
+    would get cheaper through a cell that's been left is dropped. Rovers moving onto cells can only make costs
+    higher, so a field that changes is kept, in bounds, as the estimate
+    for an A* search, which then looks at little more than the cells
+    around the change. So rovers placed or moved one at a time don't
+    throw away the fields
+    """
+    def __init__(self, plateau, turn_cost=1, max_fields=8, field_after=2,
+                 max_field_cells=1 << 16):
+        if turn_cost != int(turn_cost) or turn_cost < 1:
+            raise ValueError('turn_cost must be a positive whole number')
+        self.plateau = plateau
+        self.turn_cost = int(turn_cost)
+        self.max_fields = max_fields
+        self.field_after = field_after
+        self.width = plateau.far_right + 1
+        self.max_field_cells = max_field_cells
+        self.use_fields = self.width * (plateau.top + 1) <= max_field_cells
+        # Change in cell of a move, by heading
+        self.steps = (self.width, 1, -self.width, -1)
+        self.version = None
+        self.occupancy = None
+        self.seen = 0  # Rovers in the plateau's fleet at the last refresh
+        self.forgotten = 0  # And how many it had forgotten
+        self.last = None  # Where the last of them was
+        self.fields = collections.OrderedDict()
+        self.bounds = set()  # Targets whose fields are only lower bounds now
+        self.requests = collections.Counter()  # Plans asked for by target state
+
+    def state(self, x, y, facing):
+        "Returns the packed state of a position and facing, checking it's on the plateau"
+        plat = self.plateau
+        if not (0 <= x <= plat.far_right and 0 <= y <= plat.top):
+            raise ValueError('{} {} is not on the plateau'.format(x, y))
+        if facing.upper() not in HEADING_INDEX:
+            raise ValueError('facing must be one of N, E, S or W')
+        return (y * self.width + x) * 4 + HEADING_INDEX[facing.upper()]
+
+    def refresh(self):
+        """
+        Catches up with the rovers if they've changed, dropping the fields
+        that are too high now, and marking those that are too low
+        """
+        plat = self.plateau
+        if plat.version == self.version:
+            return
+        self.version = plat.version
+        fleet = plat.fleet
+        if self.occupancy is None or plat.forgotten != self.forgotten:
+            self.start_over()
+            return
+        moves = []  # Where each rover that could have changed was, or None, and is
+        if self.last is not None:
+            moves.append((self.last, self.seen - 1))
+        moves.extend((None, index) for index in xrange(self.seen, len(fleet)))
+        occupancy, own = self.occupancy, self.occupancy is not plat.occupancy
+        freed, taken = set(), set()
+        for old, index in moves:
+            x, y = fleet.xs[index], fleet.ys[index]
+            if old == (x, y):
+                continue
+            if old is not None:
+                if own:
+                    occupancy.remove(*old)
+                if occupancy.in_bounds(*old):
+                    freed.add(old[1] * self.width + old[0])
+            if own:
+                occupancy.add(x, y)
+            if occupancy.in_bounds(x, y):
+                taken.add(y * self.width + x)
+        self.seen = len(fleet)
+        self.last = (fleet.xs[-1], fleet.ys[-1]) if self.seen else None
+        # Other rovers can still be on a cell one has left, or already on one it's moved onto
+        has_cell = occupancy.has_cell
+        freed = set(cell for cell in freed if not has_cell(cell))
+        taken = set(cell for cell in taken if has_cell(cell))
+        for goal, field in self.fields.items():
+            if freed and not self.field_is_bound(field, freed):
+                del self.fields[goal]
+                self.bounds.discard(goal)
+            elif taken and goal not in self.bounds and not self.field_is_exact(field, taken):
+                self.bounds.add(goal)
+
+    def start_over(self):
+        """
+        Finds every rover, the first time or once the plateau has forgotten
+        some, which takes them off the plateau without saying where they
+        were, and forgets the fields
+        """
+        plat = self.plateau
+        fleet = plat.fleet
+        self.occupancy = plat.occupancy
+        if self.occupancy is None:
+            self.occupancy = OccupancyIndex(self.width, plat.top + 1)
+            for x, y in itertools.izip(fleet.xs, fleet.ys):
+                self.occupancy.add(x, y)
+        self.seen, self.forgotten = len(fleet), plat.forgotten
+        self.last = (fleet.xs[-1], fleet.ys[-1]) if self.seen else None
+        self.fields.clear()
+        self.bounds.clear()
+
+    def facing_states(self, cell):
+        "Yields each state next to a cell and facing it, and the state moving onto it leads to"
+        for direction in range(4):
+            if self.has_cell_ahead(cell, direction):
+                heading = (direction + 2) % 4
+                yield (cell + self.steps[direction]) * 4 + heading, cell * 4 + heading
+
+    def field_is_bound(self, field, freed):
+        """
+        Returns whether a field is still no higher than the cost from any
+        state, now that rovers have left the cells in freed. A field stays
+        consistent, no state's cost more than a step's cost plus the cost
+        after it, when steps are taken away, so only the moves onto freed
+        cells need checking
+        """
+        for cell in freed:
+            for state, next_state in self.facing_states(cell):
+                if field[state] > field[next_state] + 1:
+                    return False
+        return True
+
+    def field_is_exact(self, field, taken):
+        """
+        Returns whether a field's costs are still right now that rovers are
+        on the cells in taken, because every state facing one of them
+        still has a step that keeps its cost. Steps always cost something,
+        so taking those steps from any state gets to the target at its cost
+        """
+        for cell in taken:
+            for state, _ in self.facing_states(cell):
+                cost = field[state]
+                if cost and cost != UNREACHED and not any(
+                        field[next_state] + step_cost == cost
+                        for _, next_state, step_cost in self.successors(state)):
+                    return False
+        return True
+
+    def has_cell_ahead(self, cell, heading):
+        "Returns whether the cell in front of a cell, facing heading, is on the plateau"
+        if heading == 0:
+            return cell // self.width < self.plateau.top
+        elif heading == 1:
+            return cell % self.width < self.plateau.far_right
+        elif heading == 2:
+            return cell >= self.width
+        return cell % self.width > 0
+
+    def can_move(self, cell, heading):
+        "Returns whether a rover on a cell facing heading could move forward"
+        return (self.has_cell_ahead(cell, heading) and
+                not self.occupancy.has_cell(cell + self.steps[heading]))
+
+    def successors(self, state):
+        "Yields the command, next state and cost of every step that can be taken from a state"
+        cell, heading = state >> 2, state & 3
+        if self.can_move(cell, heading):
+            yield 'M', state + self.steps[heading] * 4, 1
+        yield 'L', cell * 4 + TURN_LEFT[heading], self.turn_cost
+        yield 'R', cell * 4 + TURN_RIGHT[heading], self.turn_cost
+
+    def estimate(self, state, goal):
+        """
+        Returns the cost from a state to the goal if no rovers were in the
+        way: every move needed, plus the fewest turns that face each
+        direction the rover has to move in and then the goal's heading
+        """
+        width, turns = self.width, TURN_COUNTS
+        cell, heading = state >> 2, state & 3
+        goal_cell, goal_heading = goal >> 2, goal & 3
+        x, y = cell % width, cell // width
+        goal_x, goal_y = goal_cell % width, goal_cell // width
+        directions = []
+        if goal_x != x:
+            directions.append(1 if goal_x > x else 3)
+        if goal_y != y:
+            directions.append(0 if goal_y > y else 2)
+        if not directions:
+            count = turns[heading][goal_heading]
+        elif len(directions) == 1:
+            count = turns[heading][directions[0]] + turns[directions[0]][goal_heading]
+        else:
+            first, second = directions
+            count = 1 + min(turns[heading][first] + turns[second][goal_heading],
+                            turns[heading][second] + turns[first][goal_heading])
+        return abs(goal_x - x) + abs(goal_y - y) + self.turn_cost * count
+
+    def search(self, start, goal, field=None):
+        """
+        Returns the cheapest command string from start to goal with A*, or
+        None if there isn't one. Given a field no higher than the cost from
+        any state, its costs are the estimates
+        """
+        if field is None:
+            estimate = self.estimate
+        else:
+            estimate = lambda state, goal: field[state]
+        costs = {start: 0}
+        came_from = {}
+        # Ties go to the state furthest along, which heads straight for the goal
+        queue = [(estimate(start, goal), 0, start)]
+        while queue:
+            _, cost, state = heapq.heappop(queue)
+            cost = -cost
+            if state == goal:
+                commands = []
+                while state != start:
+                    state, command = came_from[state]
+                    commands.append(command)
+                return ''.join(reversed(commands))
+            if cost > costs[state]:
+                continue  # Already expanded at a lower cost
+            for command, next_state, step_cost in self.successors(state):
+                next_cost = cost + step_cost
+                if next_cost < costs.get(next_state, UNREACHED):
+                    left = estimate(next_state, goal)
+                    if left == UNREACHED:
+                        continue  # Couldn't get to the goal with fewer rovers in the way
+                    costs[next_state] = next_cost
+                    came_from[next_state] = state, command
+                    heapq.heappush(queue, (next_cost + left, -next_cost, next_state))
+        return None
+
+    def distance_field(self, target_x, target_y, target_facing):
+        """
+        Returns an array of the cost from every state to a target, or
+        UNREACHED, with the rovers where they are now. Cached fields are
+        reused, unless they're only bounds. Raises a ValueError on plateaus
+        of more than max_field_cells cells
+        """
+        if not self.use_fields:
+            raise ValueError('The plateau has more than {:,} cells'.format(self.max_field_cells))
+        self.refresh()
+        goal = self.state(target_x, target_y, target_facing)
+        if goal in self.fields and goal not in self.bounds:
+            self.fields[goal] = field = self.fields.pop(goal)  # Most recently used
+            return field
+        plat = self.plateau
+        width, steps, turn_cost = self.width, self.steps, self.turn_cost
+        has_cell = self.occupancy.has_cell
+        field = array.array('i', [UNREACHED]) * (width * (plat.top + 1) * 4)
+        field[goal] = 0
+        queue = [(0, goal)]
+        while queue:
+            cost, state = heapq.heappop(queue)
+            if cost > field[state]:
+                continue
+            cell, heading = state >> 2, state & 3
+            predecessors = [(cell * 4 + TURN_RIGHT[heading], turn_cost),
+                            (cell * 4 + TURN_LEFT[heading], turn_cost)]
+            # Only a free cell can be moved onto, but one can be moved off of
+            # a rover's cell, like the start of a plan for the current rover
+            if not has_cell(cell) and self.has_cell_ahead(cell, (heading + 2) % 4):
+                predecessors.append((state - steps[heading] * 4, 1))
+            for previous, step_cost in predecessors:
+                if cost + step_cost < field[previous]:
+                    field[previous] = cost + step_cost
+                    heapq.heappush(queue, (cost + step_cost, previous))
+        self.fields.pop(goal, None)
+        self.fields[goal] = field
+        self.bounds.discard(goal)
+        del self.requests[goal]
+        if len(self.fields) > self.max_fields:
+            self.bounds.discard(self.fields.popitem(last=False)[0])
+        return field
+
+    def follow(self, field, start):
+        "Returns the commands that walk down a distance field from start"
+        commands = []
+        state = start
+        while field[state]:
+            for command, next_state, step_cost in self.successors(state):
+                if field[next_state] + step_cost == field[state]:
+                    commands.append(command)
+                    state = next_state
+                    break
+        return ''.join(commands)
+
+    def plan(self, x, y, facing, target_x, target_y, target_facing):
+        """
+        Returns the cheapest string of L, R and M commands that takes a
+        rover at x, y facing facing to target_x, target_y facing
+        target_facing. Every rover on the plateau is in the way, apart from
+        one on the start cell, so the plan can be made for the current
+        rover before or after it's created. Raises a ValueError if the
+        target can't be reached
+        """
+        self.refresh()
+        start = self.state(x, y, facing)
+        goal = self.state(target_x, target_y, target_facing)
+        if self.occupancy.has_cell(goal >> 2) and goal >> 2 != start >> 2:
+            raise ValueError('{} {} has a rover on it'.format(target_x, target_y))
+        field = self.fields.get(goal)
+        if field is None and self.use_fields:
+            self.requests[goal] += 1
+            if self.requests[goal] >= self.field_after:
+                field = self.distance_field(target_x, target_y, target_facing)
+        elif field is not None:
+            self.fields[goal] = self.fields.pop(goal)  # Most recently used
+        if field is None:
+            commands = self.search(start, goal)
+        elif field[start] == UNREACHED:
+            commands = None
+        elif goal in self.bounds:
+            commands = self.search(start, goal, field)
+        else:
+            commands = self.follow(field, start)
+        if commands is None:
+            raise ValueError('No path from {} {} {} to {} {} {}'.format(
+                x, y, facing, target_x, target_y, target_facing))
+        return commands
+
+
+# Codes of the commands in a command matrix, with 0 for no command, which
+# pads the shorter missions
+NO_COMMAND, LEFT_COMMAND, RIGHT_COMMAND, MOVE_COMMAND = range(4)
+COMMAND_CODES = {'L': LEFT_COMMAND, 'R': RIGHT_COMMAND, 'M': MOVE_COMMAND}
+
+BatchResult = collections.namedtuple(
+    'BatchResult', ['x', 'y', 'heading', 'edge_blocked', 'negative_blocked'])
+
+
+def encode_commands(command_strings):
+    """
+    Returns a NumPy matrix with a row of command codes for each command
+    string, padded with NO_COMMAND to the length of the longest
+    """
+    length = max(len(commands) for commands in command_strings) if command_strings else 0
+    codes = np.zeros(256, dtype=np.uint8)
+    for command, code in COMMAND_CODES.items():
+        codes[ord(command)] = code
+    matrix = np.zeros((len(command_strings), length), dtype=np.uint8)
+    for row, commands in enumerate(command_strings):
+        characters = np.frombuffer(commands, dtype=np.uint8)
+        encoded = codes[characters]
+        invalid = np.flatnonzero(encoded == NO_COMMAND)
+        if len(invalid):
+            raise ValueError('Invalid command {!r} in mission {}'.format(
+                commands[invalid[0]], row))
+        matrix[row, :len(commands)] = encoded
+    return matrix
+
+
+def simulate_batch(far_right, top, x, y, heading, command_matrix):
+    """
+    Runs many independent missions together, each a rover on a plateau of
+    its own, one command step at a time across every mission. The plateau
+    bounds, starting positions and integer headings are arrays with an entry
+    per mission, and command_matrix has a row of command codes per mission.
+    Moves are checked against each mission's bounds with masks, like
+    move_rover. Returns a BatchResult of where each rover ends up and how
+    many of its moves were blocked by the top or right edges and by negative
+    coordinates
+    """
+    if np is None:
+        raise ImportError('simulate_batch needs NumPy')
+    far_right, top = np.asarray(far_right, dtype=np.int64), np.asarray(top, dtype=np.int64)
+    x, y = np.array(x, dtype=np.int64), np.array(y, dtype=np.int64)
+    heading = np.array(heading, dtype=np.int64)
+    if (x < 0).any() or (y < 0).any():
+        raise ValueError('Cannot initiate a rover with negative coordinates')
+    dx, dy = np.array(DX, dtype=np.int64), np.array(DY, dtype=np.int64)
+    turn = np.zeros(4, dtype=np.int64)  # Change in heading, by command code
+    turn[LEFT_COMMAND], turn[RIGHT_COMMAND] = 3, 1
+    edge_blocked = np.zeros(len(x), dtype=np.int64)
+    negative_blocked = np.zeros(len(x), dtype=np.int64)
+
+    for step in np.asarray(command_matrix).T:
+        heading = (heading + turn[step]) & 3
+        moving = step == MOVE_COMMAND
+        if not moving.any():
+            continue
+        next_x = x + dx[heading]
+        next_y = y + dy[heading]
+        off_edge = moving & ((next_x > far_right) | (next_y > top))
+        negative = moving & ~off_edge & ((next_x < 0) | (next_y < 0))
+        allowed = moving & ~off_edge & ~negative
+        x = np.where(allowed, next_x, x)
+        y = np.where(allowed, next_y, y)
+        edge_blocked += off_edge
+        negative_blocked += negative
+    return BatchResult(x, y, heading, edge_blocked, negative_blocked)
+
+
+def simulate_missions(plateaus, rovers, command_strings):
+    """
+    Runs simulate_batch on missions given like main's input: a (far right,
+    top) pair for each plateau, an (x, y, facing) triple for each rover and
+    a command string for each
+    """
+    if np is None:
+        raise ImportError('simulate_missions needs NumPy')
+    far_right, top = (np.array(bounds, dtype=np.int64) for bounds in zip(*plateaus))
+    x, y, facings = zip(*rovers)
+    heading = [HEADING_INDEX[facing.upper()] for facing in facings]
+    return simulate_batch(far_right, top, x, y, heading, encode_commands(command_strings))
+
+
+def iter_mission_parts(stream, block_size=1 << 20):
+    """
+    Reads input like main's from a file object in blocks, and generates
+    ('plateau', line), then ('rover', line) and ('commands', chunk) parts
+    in turn. Plateau and rover lines come whole, but each command line
+    comes in chunks as it's read, so a long one is never held in memory.
+    Stops at an empty line or the end of the stream
+    """
+    kinds = itertools.chain(['plateau'], itertools.cycle(['rover', 'commands']))
+    kind = next(kinds)
+    pieces = []  # The start of a plateau or rover line, from earlier blocks
+    line_started = False
+    carriage_return = ''  # Held back from a chunk in case it ends its line
+    for block in iter(lambda: stream.read(block_size), ''):
+        start = 0
+        while start < len(block):
+            end = block.find('\n', start)
+            if end == -1:  # The line carries on into the next block
+                piece = block[start:]
+                line_started = True
+                if kind == 'commands':
+                    piece = carriage_return + piece
+                    carriage_return = '\r' if piece.endswith('\r') else ''
+                    if carriage_return:
+                        piece = piece[:-1]
+                    if piece:
+                        yield kind, piece
+                else:
+                    pieces.append(piece)
+                break
+
+            piece = block[start:end]
+            if kind == 'commands':
+                piece = (carriage_return + piece).rstrip('\r')
+                carriage_return = ''
+                if piece:
+                    yield kind, piece
+            else:
+                pieces.append(piece)
+                piece = ''.join(pieces).rstrip('\r')
+                pieces = []
+                if piece:
+                    yield kind, piece
+            if not piece and not line_started:
+                return
+            kind = next(kinds)
+            line_started = False
+            start = end + 1
+    if pieces:
+        yield kind, ''.join(pieces).rstrip('\r')
+
+
+def run_mission_stream(stream, output, collisions=None, quiet=False, block_size=1 << 20,
+                       write_every=1024):
+    """
+    Runs the missions read from a file object with iter_mission_parts, and
+    writes the final position of each rover to output as it retires, a
+    batch of write_every rovers at a time. Written rovers are forgotten,
+    unless they're needed for collision checks. Returns the plateau, or None
+    if there was no input
+    """
+    plat = None
+    written = 0  # Rovers at the start of the plateau's fleet already written
+    for kind, part in iter_mission_parts(stream, block_size):
+        if kind == 'commands':
+            plat.run_commands(part)
+        elif kind == 'rover':
+            rover_args = part.split()[:3]
+            rover_args[:2] = map(int, rover_args[:2])
+            plat.create_rover(*rover_args)
+            if plat.retired_count - written >= write_every:
+                output.write(plat.fleet.format_positions(written, plat.retired_count))
+                written = plat.retired_count
+                if collisions is None:
+                    plat.drop_retired()
+                    written = 0
+        else:
+            plat_args = map(int, part.split()[:2])
+            plat = Plateau(*plat_args, collisions=collisions, quiet=quiet)
+    if plat is None:
+        return None
+    if plat.rover:
+        plat.retired_count = len(plat.fleet)
+    output.write(plat.fleet.format_positions(written, plat.retired_count))
+    output.flush()
+    return plat
+
+
+def main(collisions=None, quiet=False):
     user_input = raw_input('Please input the upper-right coordinates of the plateau\n')
     plat_args = map(int, user_input.split()[:2])
 
-    plat = Plateau(*plat_args)
-    plat_commands = {'R': plat.turn_rover_right,
-                     'L': plat.turn_rover_left,
-                     'M': plat.move_rover}
+    plat = Plateau(*plat_args, collisions=collisions, quiet=quiet)
 
     # Loop for the rest of the input
     user_input = raw_input()
@@ -122,15 +1270,14 @@ def main():
             rover_args[:2] = map(int, rover_args[:2])
             plat.create_rover(*rover_args)
         else:  # Execute movements on the current active rover
-            movements = list(user_input)
-            for movement in movements:
-                plat_commands[movement]()
+            plat.run_commands(user_input)
 
         user_input = raw_input()
         task_count += 1
 
     # Print the result
     plat.print_rovers()
+    return plat
 
 
 if __name__ == '__main__':
@@ -235,8 +1382,526 @@ if __name__ == '__main__':
                 result.append(plat.rover.y)
                 self.assertTrue(all(res == 5 for res in result))
 
+            def test_block_collisions(self):
+                plat = Plateau(5, 5, collisions='block')
+                plat.create_rover(1, 2, 'N')
+                plat.create_rover(1, 1, 'N')
+                plat.move_rover()
+                self.assertEqual((plat.rover.x, plat.rover.y), (1, 1))
+                plat.turn_rover_right()
+                plat.move_rover()
+                self.assertEqual((plat.rover.x, plat.rover.y), (2, 1))
+                self.assertEqual(plat.collision_count, 1)
+                with self.assertRaises(ValueError):
+                    plat.create_rover(1, 2, 'S')
+                # The cell the rover left is free again
+                plat.create_rover(1, 1, 'S')
+                self.assertEqual(plat.occupancy.count, 3)
+
+            def test_report_collisions(self):
+                plat = Plateau(5, 5, collisions='report')
+                plat.create_rover(1, 2, 'N')
+                plat.create_rover(1, 1, 'N')
+                plat.move_rover()
+                plat.move_rover()
+                self.assertEqual((plat.rover.x, plat.rover.y), (1, 3))
+                self.assertEqual(plat.collision_count, 1)
+                self.assertTrue(plat.occupancy.is_occupied(1, 2))
+                self.assertFalse(plat.occupancy.is_occupied(1, 1))
+
+        class RunCommandsTest(unittest.TestCase):
+            def run_both_ways(self, plateau_args, rovers, commands):
+                """
+                Runs commands on the last of rovers with run_commands and
+                one command at a time, returning each way's rovers and output
+                """
+                import cStringIO
+                results = []
+                for compiled in (True, False):
+                    plat = Plateau(*plateau_args)
+                    stdout = sys.stdout
+                    sys.stdout = output = cStringIO.StringIO()
+                    try:
+                        for rover in rovers:
+                            plat.create_rover(*rover)
+                        if compiled:
+                            plat.run_commands(commands)
+                        else:
+                            plat_commands = {'R': plat.turn_rover_right,
+                                             'L': plat.turn_rover_left,
+                                             'M': plat.move_rover}
+                            for command in commands:
+                                plat_commands[command]()
+                    finally:
+                        sys.stdout = stdout
+                    positions = [rover.get_position()
+                                 for rover in list(plat.retired_rovers) + [plat.rover]]
+                    results.append((positions, output.getvalue(), plat.collision_count))
+                return results
+
+            def test_matches_step_by_step(self):
+                import random
+                generator = random.Random(1)
+                for trial in range(300):
+                    far_right, top = generator.randint(0, 6), generator.randint(0, 6)
+                    collisions = generator.choice([None, 'block', 'report'])
+                    rovers = set()
+                    while len(rovers) < generator.randint(1, 4):
+                        rovers.add((generator.randint(0, 8), generator.randint(0, 8),
+                                    generator.choice('NESW')))
+                    commands = ''.join(generator.choice(['M', 'MMMM', 'L', 'R', 'LL', 'RRR'])
+                                       for _ in range(generator.randint(0, 20)))
+                    if collisions == 'block':  # Creating rovers on top of each other fails
+                        cells = {}
+                        for rover in rovers:
+                            cells[rover[:2]] = rover
+                        rovers = cells.values()
+                    compiled, stepped = self.run_both_ways(
+                        (far_right, top, collisions), list(rovers), commands)
+                    self.assertEqual(compiled, stepped, (far_right, top, rovers, commands))
+
+            def test_long_command_strings(self):
+                plat = Plateau(5, 200000)
+                plat.create_rover(1, 2, 'N')
+                plat.run_commands('LMLMLMLMM' * 100000 + 'R' * 999999)
+                self.assertEqual(plat.rover.get_position(), {'x': 1, 'y': 100002, 'facing': 'W'})
+
+            def test_invalid_command_after_valid_ones(self):
+                plat = Plateau(5, 5)
+                plat.create_rover(1, 2, 'N')
+                with self.assertRaises(KeyError):
+                    plat.run_commands('MMRX')
+                self.assertEqual(plat.rover.get_position(), {'x': 1, 'y': 4, 'facing': 'E'})
+
+        @unittest.skipIf(np is None, 'NumPy is not installed')
+        class BatchSimulationTest(unittest.TestCase):
+            def test_matches_running_missions_one_at_a_time(self):
+                import cStringIO
+                import random
+                generator = random.Random(2)
+                plateaus, rovers, command_strings = [], [], []
+                for mission in range(500):
+                    plateaus.append((generator.randint(0, 6), generator.randint(0, 6)))
+                    rovers.append((generator.randint(0, 8), generator.randint(0, 8),
+                                   generator.choice('NESW')))
+                    command_strings.append(''.join(generator.choice('LRMMM')
+                                                   for _ in range(generator.randint(0, 30))))
+                result = simulate_missions(plateaus, rovers, command_strings)
+
+                for mission in range(500):
+                    plat = Plateau(*plateaus[mission])
+                    plat.create_rover(*rovers[mission])
+                    stdout = sys.stdout
+                    sys.stdout = output = cStringIO.StringIO()
+                    try:
+                        for command in command_strings[mission]:
+                            {'L': plat.turn_rover_left, 'R': plat.turn_rover_right,
+                             'M': plat.move_rover}[command]()
+                    finally:
+                        sys.stdout = stdout
+                    messages = output.getvalue().splitlines()
+                    self.assertEqual(
+                        (result.x[mission], result.y[mission], HEADINGS[result.heading[mission]],
+                         result.edge_blocked[mission], result.negative_blocked[mission]),
+                        (plat.rover.x, plat.rover.y, plat.rover.facing,
+                         messages.count(EDGE_MESSAGE), messages.count(NEGATIVE_MESSAGE)))
+
+            def test_invalid_commands(self):
+                with self.assertRaises(ValueError):
+                    simulate_missions([(5, 5)], [(1, 2, 'N')], ['LMX'])
+
+        class MissionStreamTest(unittest.TestCase):
+            missions = '5 5\n1 2 N\nLMLMLMLMM\n3 3 E\nMMRMMRMRRM\n'
+
+            def run_stream(self, text, **kwargs):
+                import cStringIO
+                output = cStringIO.StringIO()
+                plat = run_mission_stream(cStringIO.StringIO(text), output, **kwargs)
+                return output.getvalue(), plat
+
+            def test_matches_sample_output_at_any_block_size(self):
+                for block_size in (1, 2, 3, 7, 1 << 20):
+                    for text in (self.missions, self.missions.replace('\n', '\r\n'),
+                                 self.missions.rstrip('\n'), self.missions + '\n1 1 N\nM\n'):
+                        output, _ = self.run_stream(text, block_size=block_size, write_every=1)
+                        self.assertEqual(output, '1 3 N\n5 1 E\n', (block_size, text))
+
+            def test_command_lines_come_in_chunks(self):
+                import cStringIO
+                text = '5 5\n1 2 N\n' + 'LMLMLMLMM' * 100 + '\n'
+                parts = list(iter_mission_parts(cStringIO.StringIO(text), block_size=64))
+                self.assertEqual(parts[:2], [('plateau', '5 5'), ('rover', '1 2 N')])
+                self.assertTrue(all(kind == 'commands' and len(chunk) <= 64
+                                    for kind, chunk in parts[2:]))
+                self.assertEqual(''.join(chunk for _, chunk in parts[2:]), 'LMLMLMLMM' * 100)
+
+            def test_quiet_mode_counts_blocked_moves(self):
+                output, plat = self.run_stream('2 2\n0 0 S\nMMRMLLMMMM\n1 1 N\nMM\n', quiet=True)
+                self.assertEqual(output, '2 0 E\n1 2 N\n')
+                self.assertEqual(plat.blocked_moves, {'negative': 3, 'edge': 3})
+
+            def test_written_rovers_are_forgotten_without_collision_checks(self):
+                text = '9 9\n' + ''.join('{} {} N\nM\n'.format(x, x) for x in range(8))
+                expected = ''.join('{} {} N\n'.format(x, x + 1) for x in range(8))
+                output, plat = self.run_stream(text, write_every=3)
+                self.assertEqual(output, expected)
+                self.assertTrue(len(plat.fleet) < 4)
+                output, plat = self.run_stream(text, write_every=3, collisions='block')
+                self.assertEqual(output, expected)
+                self.assertEqual(len(plat.fleet), 8)
+
+        class TrajectoryRecorderTest(unittest.TestCase):
+            def test_positions_at_every_step(self):
+                import cStringIO
+                import random
+                generator = random.Random(3)
+                for trial in range(30):
+                    recorder = TrajectoryRecorder(checkpoint_every=generator.randint(1, 6))
+                    plat = Plateau(6, 6, collisions=generator.choice([None, 'report']),
+                                   quiet=True, recorder=recorder)
+                    expected = []  # Positions of each rover after each step
+                    for rover in range(3):
+                        # Sometimes just off the plateau, where a rover can still move on
+                        start = [generator.randint(0, 6), generator.randint(0, 6)]
+                        if generator.random() < 0.3:
+                            start[generator.randint(0, 1)] = 7
+                        plat.create_rover(start[0], start[1], generator.choice('NESW'))
+                        positions = [plat.rover.get_position()]
+                        for _ in range(generator.randint(0, 5)):
+                            commands = ''.join(generator.choice('LRMMM')
+                                               for _ in range(generator.randint(1, 9)))
+                            if len(commands) == 1:  # One at a time, the old way
+                                {'L': plat.turn_rover_left, 'R': plat.turn_rover_right,
+                                 'M': plat.move_rover}[commands]()
+                                positions.append(plat.rover.get_position())
+                                continue
+                            for command in commands:
+                                step = Plateau(6, 6, quiet=True)
+                                step.create_rover(**positions[-1])
+                                step.run_commands(command)
+                                positions.append(step.rover.get_position())
+                            plat.run_commands(commands)
+                            self.assertEqual(plat.rover.get_position(), positions[-1])
+                        expected.append(positions)
+
+                    def cells_on_plateau(positions):
+                        return set((p['x'], p['y']) for p in positions
+                                   if p['x'] <= 6 and p['y'] <= 6)
+
+                    for rover, positions in enumerate(expected):
+                        self.assertEqual(recorder.steps(rover), len(positions) - 1)
+                        for step, position in enumerate(positions):
+                            self.assertEqual(recorder.position_at(rover, step), position)
+                        for x, y in cells_on_plateau(positions):
+                            self.assertTrue(rover in recorder.rovers_visiting(x, y))
+                            self.assertTrue(y * 7 + x in recorder.coverage)
+                    visited = set.union(*map(cells_on_plateau, expected))
+                    self.assertEqual(len(recorder.coverage), len(visited))
+                    self.assertEqual(sum(len(cells) for cells in recorder.visited),
+                                     sum(len(cells_on_plateau(positions))
+                                         for positions in expected))
+
+            def test_rover_moving_onto_the_plateau(self):
+                recorder = TrajectoryRecorder(4)
+                plat = Plateau(5, 5, recorder=recorder)
+                plat.create_rover(6, 2, 'W')
+                plat.run_commands('MMMM')
+                self.assertEqual((plat.rover.x, plat.rover.y), (2, 2))
+                self.assertEqual(recorder.rovers_visiting(3, 2), [0])
+                self.assertEqual(len(recorder.coverage), 4)
+                self.assertEqual(recorder.rovers_visiting(6, 2), [])
+
+            def test_replay_blocks_rovers_on_earlier_rovers(self):
+                recorder = TrajectoryRecorder(checkpoint_every=100)
+                plat = Plateau(5, 5, collisions='block', quiet=True, recorder=recorder)
+                plat.create_rover(3, 2, 'S')
+                plat.run_commands('MM')
+                plat.create_rover(0, 0, 'E')
+                plat.run_commands('MMMMLM')  # Blocked by the first rover after two moves
+                plat.create_rover(1, 0, 'N')  # On a cell the second rover went through
+                self.assertEqual(recorder.position_at(0, 1), {'x': 3, 'y': 1, 'facing': 'S'})
+                self.assertEqual(recorder.position_at(1, 4), {'x': 2, 'y': 0, 'facing': 'E'})
+                self.assertEqual(recorder.position_at(1, 6), {'x': 2, 'y': 1, 'facing': 'N'})
+                self.assertEqual(plat.retired_rovers[1].get_position(),
+                                 recorder.position_at(1, 6))
+                with self.assertRaises(IndexError):
+                    recorder.position_at(1, 7)
+
+            def test_compressed_bitmap(self):
+                bitmap = CompressedBitmap()
+                values = range(0, 20000, 3) + [70000, 1 << 20]
+                for value in values + values[:10]:
+                    bitmap.add(value)
+                self.assertEqual(len(bitmap), len(values))
+                self.assertTrue(all(value in bitmap for value in values))
+                self.assertFalse(1 in bitmap or 70001 in bitmap or 5 << 20 in bitmap)
+                self.assertTrue(isinstance(bitmap.containers[0], bytearray))
+                self.assertTrue(isinstance(bitmap.containers[1], array.array))
+
+        class FleetTest(unittest.TestCase):
+            def test_rovers_are_views_over_the_fleet(self):
+                fleet = Fleet()
+                rover1 = Rover(1, 2, 'n', fleet)
+                rover2 = Rover(3, 4, 'W', fleet)
+                rover2.turn_left()
+                rover2.move_forward()
+                self.assertEqual((len(fleet), rover1.index, rover2.index), (2, 0, 1))
+                self.assertEqual(list(fleet.xs), [1, 3])
+                self.assertEqual(list(fleet.ys), [2, 3])
+                self.assertEqual(RoverList(fleet, 0, 2)[-1].get_position(),
+                                 {'x': 3, 'y': 3, 'facing': 'S'})
+                self.assertFalse(hasattr(rover1, '__dict__'))
+                with self.assertRaises(ValueError):
+                    Rover(1, 1, 'X')
+
+            def test_print_rovers_writes_every_rover(self):
+                import cStringIO
+                plat = Plateau(5, 5)
+                for x in range(3):
+                    plat.create_rover(x, x + 1, 'NESW'[x])
+                stdout = sys.stdout
+                sys.stdout = output = cStringIO.StringIO()
+                try:
+                    plat.print_rovers()
+                finally:
+                    sys.stdout = stdout
+                self.assertEqual(output.getvalue(), '0 1 N\n1 2 E\n2 3 S\n')
+                self.assertEqual(len(plat.retired_rovers), 3)
+
+        class OccupancyIndexTest(unittest.TestCase):
+            def test_switches_to_bitset_without_losing_cells(self):
+                index = OccupancyIndex(1000, 1000)
+                cells = [(i * 7 % 1000, i // 1000 * 500 + i % 3) for i in range(2000)]
+                for x, y in cells[:1000]:
+                    index.add(x, y)
+                self.assertEqual(index.bits, None)
+                for x, y in cells[1000:]:
+                    index.add(x, y)
+                self.assertNotEqual(index.bits, None)
+                self.assertEqual(len(index.bits), 1000 * 1000 // 8)
+                self.assertTrue(all(index.is_occupied(x, y) for x, y in cells))
+                self.assertFalse(index.is_occupied(1, 0))
+                self.assertFalse(index.is_occupied(-1, 0) or index.is_occupied(0, 1000))
+
+            def test_stacked_rovers(self):
+                for use_bitset in (False, True):
+                    index = OccupancyIndex(3, 3)
+                    if use_bitset:
+                        index.use_bitset()
+                    index.add(1, 1)
+                    index.add(1, 1)
+                    index.remove(1, 1)
+                    self.assertTrue(index.is_occupied(1, 1))
+                    index.remove(1, 1)
+                    self.assertFalse(index.is_occupied(1, 1))
+                    self.assertEqual(index.count, 0)
+
+        class PathPlannerTest(unittest.TestCase):
+            def cheapest_cost(self, plat, start, goal, turn_cost):
+                "Finds the cost of the cheapest plan by trying every state, the slow way"
+                occupied = set(zip(plat.fleet.xs, plat.fleet.ys))
+                costs = {start: 0}
+                frontier = [start]
+                while frontier:
+                    next_frontier = []
+                    for x, y, heading in frontier:
+                        cost = costs[x, y, heading]
+                        steps = [((x, y, TURN_LEFT[heading]), turn_cost),
+                                 ((x, y, TURN_RIGHT[heading]), turn_cost)]
+                        next_x, next_y = x + DX[heading], y + DY[heading]
+                        if (0 <= next_x <= plat.far_right and 0 <= next_y <= plat.top and
+                                (next_x, next_y) not in occupied):
+                            steps.append(((next_x, next_y, heading), 1))
+                        for state, step_cost in steps:
+                            if cost + step_cost < costs.get(state, UNREACHED):
+                                costs[state] = cost + step_cost
+                                next_frontier.append(state)
+                    frontier = next_frontier
+                return costs.get(goal)
+
+            def plan_cost(self, commands, turn_cost):
+                return commands.count('M') + turn_cost * (len(commands) - commands.count('M'))
+
+            def test_plans_are_cheapest_and_replay(self):
+                import random
+                generator = random.Random(2)
+                for trial in range(150):
+                    far_right, top = generator.randint(0, 7), generator.randint(0, 7)
+                    turn_cost = generator.choice([1, 1, 3])
+                    plat = Plateau(far_right, top, collisions='block', quiet=True)
+                    cells = [(x, y) for x in range(far_right + 1) for y in range(top + 1)]
+                    generator.shuffle(cells)
+                    for x, y in cells[:len(cells) // 3]:
+                        plat.create_rover(x, y, 'N')
+                    free = cells[len(cells) // 3:]
+                    start = generator.choice(free) + (generator.choice('NESW'),)
+                    target = generator.choice(free) + (generator.choice('NESW'),)
+                    plat.create_rover(*start)
+                    planner = PathPlanner(plat, turn_cost)
+                    expected = self.cheapest_cost(
+                        plat, start[:2] + (HEADING_INDEX[start[2]],),
+                        target[:2] + (HEADING_INDEX[target[2]],), turn_cost)
+                    if expected is None:
+                        with self.assertRaises(ValueError):
+                            planner.plan(*(start + target))
+                        continue
+                    # Once with A*, and again from the distance field
+                    plans = [planner.plan(*(start + target)) for _ in range(2)]
+                    self.assertEqual(len(planner.fields), 1)
+                    for commands in plans:
+                        self.assertEqual(self.plan_cost(commands, turn_cost), expected)
+                    plat_commands = {'R': plat.turn_rover_right,
+                                     'L': plat.turn_rover_left,
+                                     'M': plat.move_rover}
+                    for command in plans[1]:
+                        plat_commands[command]()
+                    self.assertEqual((plat.rover.x, plat.rover.y, plat.rover.facing), target)
+                    self.assertFalse(plat.blocked_moves)
+
+            def test_turn_cost(self):
+                plat = Plateau(4, 4)
+                plat.create_rover(1, 3, 'N')  # In the way of going straight up
+                # Turning around is cheaper than going the long way
+                commands = PathPlanner(plat).plan(1, 2, 'E', 0, 4, 'S')
+                self.assertEqual((commands.count('M'), self.plan_cost(commands, 1)), (3, 8))
+                # Unless turns cost a lot more than moves
+                commands = PathPlanner(plat, turn_cost=10).plan(1, 2, 'E', 0, 4, 'S')
+                self.assertEqual((commands.count('M'), self.plan_cost(commands, 10)), (5, 35))
+                with self.assertRaises(ValueError):
+                    PathPlanner(plat, turn_cost=0)
+
+            def test_fields_are_dropped_when_rovers_move(self):
+                plat = Plateau(9, 9)
+                plat.create_rover(5, 5, 'N')
+                planner = PathPlanner(plat)
+                for start in range(3):
+                    planner.plan(start, 0, 'E', 5, 7, 'N')
+                self.assertEqual(len(planner.fields), 1)
+                plat.move_rover()
+                plat.move_rover()
+                # The rover is on the target now
+                with self.assertRaises(ValueError):
+                    planner.plan(0, 0, 'E', 5, 7, 'N')
+                self.assertFalse(planner.fields)
+
+            def test_fields_kept_while_rovers_move_one_at_a_time(self):
+                import random
+                generator = random.Random(3)
+                kept = collections.Counter()
+                for trial in range(60):
+                    # The plateau's index, or one of the planner's own with rovers stacking up
+                    plat = Plateau(7, 7, collisions=['block', None, 'report'][trial % 3],
+                                   quiet=True)
+                    cells = [(x, y) for x in range(8) for y in range(8)]
+                    generator.shuffle(cells)
+                    target = cells.pop() + (generator.choice('NESW'),)
+                    for x, y in cells[:6]:
+                        plat.create_rover(x, y, generator.choice('NESW'))
+                    planner = PathPlanner(plat)
+                    for step in range(15):
+                        occupied = set(zip(plat.fleet.xs, plat.fleet.ys))
+                        if generator.random() < 0.3:
+                            plat.create_rover(*(generator.choice(
+                                [cell for cell in cells if cell not in occupied]) + ('N',)))
+                        else:
+                            plat.run_commands(generator.choice('LRMMM'))
+                        had_field = bool(planner.fields)
+                        planner.refresh()
+                        if had_field and planner.fields:
+                            kept['bound' if planner.bounds else 'exact'] += 1
+                        occupied = set(zip(plat.fleet.xs, plat.fleet.ys))
+                        start = generator.choice(
+                            [cell for cell in cells if cell not in occupied]) + ('E',)
+                        expected = None
+                        if target[:2] not in occupied:
+                            expected = self.cheapest_cost(
+                                plat, start[:2] + (HEADING_INDEX['E'],),
+                                target[:2] + (HEADING_INDEX[target[2]],), 1)
+                        if expected is None:
+                            with self.assertRaises(ValueError):
+                                planner.plan(*(start + target))
+                        else:
+                            commands = planner.plan(*(start + target))
+                            self.assertEqual(self.plan_cost(commands, 1), expected)
+                # Plans are checked with the fields as they are, and as bounds
+                self.assertGreater(kept['exact'], 50)
+                self.assertGreater(kept['bound'], 50)
+
+            def test_no_fields_on_large_plateaus(self):
+                plat = Plateau(999, 999)
+                plat.create_rover(500, 500, 'N')
+                planner = PathPlanner(plat)
+                for _ in range(3):
+                    commands = planner.plan(0, 0, 'N', 999, 999, 'E')
+                    self.assertEqual(self.plan_cost(commands, 1), 1998 + 1)
+                self.assertFalse(planner.fields or planner.requests)
+                with self.assertRaises(ValueError):
+                    planner.distance_field(999, 999, 'E')
+
+            def test_forgotten_rovers_leave_the_plateau(self):
+                plat = Plateau(4, 4, quiet=True)
+                planner = PathPlanner(plat)
+                plat.create_rover(0, 1, 'N')
+                plat.create_rover(0, 0, 'N')
+                self.assertEqual(planner.plan(0, 0, 'N', 0, 2, 'N'), 'RMLMMLMR')
+                plat.drop_retired()
+                self.assertEqual(planner.plan(0, 0, 'N', 0, 2, 'N'), 'MM')
+
+            def test_unreachable_target(self):
+                plat = Plateau(4, 4)
+                for x, y in ((3, 4), (3, 3), (4, 3)):
+                    plat.create_rover(x, y, 'N')
+                planner = PathPlanner(plat)
+                for _ in range(2):
+                    with self.assertRaises(ValueError):
+                        planner.plan(0, 0, 'N', 4, 4, 'N')
+                with self.assertRaises(ValueError):
+                    planner.plan(0, 0, 'N', 5, 0, 'N')
+                self.assertEqual(planner.plan(4, 4, 'N', 4, 4, 'S'), 'RR')
+
         unittest.main()
 
     else:
+        import argparse
+        import os
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import instrumentation
+
+        parser = argparse.ArgumentParser(description='Move rovers around a plateau')
+        parser.add_argument('input', nargs='?',
+                            help='a file of missions to run, or - for stdin, instead of '
+                                 'asking for them')
+        parser.add_argument('-o', '--output',
+                            help='where to write the final positions (default: stdout)')
+        parser.add_argument('-q', '--quiet', action='store_true',
+                            help='count blocked moves instead of printing a message for each')
+        parser.add_argument('--collisions', choices=['block', 'report'],
+                            help='stop rovers moving onto each other, or report it')
+        parser.add_argument('--block-size', type=int, default=1 << 20,
+                            help='bytes of input to read at a time (default: 1048576)')
+        instrumentation.add_arguments(parser)
+        args = parser.parse_args()
+
+        # Missions run their commands with run_commands, and move_rover and the
+        # turns are what a recorder or a caller going one command at a time uses
+        hot_functions = [(Plateau, name, 'Plateau.' + name)
+                         for name in ('create_rover', 'run_commands', 'run_moves', 'move_rover',
+                                      'turn_rover_left', 'turn_rover_right')]
+
         # Run the program
-        main()
+        with instrumentation.instrumented(args, 'rover', hot_functions):
+            if args.input is None:
+                plat = main(args.collisions, args.quiet)
+            else:
+                stream = sys.stdin if args.input == '-' else open(args.input, 'rb')
+                output = open(args.output, 'wb') if args.output else sys.stdout
+                try:
+                    plat = run_mission_stream(stream, output, args.collisions, args.quiet,
+                                              args.block_size)
+                finally:
+                    if output is not sys.stdout:
+                        output.close()
+        if args.quiet and plat:
+            sys.stderr.write('Blocked moves: {} off the edge, {} below zero, {} into rovers\n'
+                             .format(plat.blocked_moves['edge'], plat.blocked_moves['negative'],
+                                     plat.blocked_moves['rover']))
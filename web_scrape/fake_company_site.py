@@ -0,0 +1,296 @@
+"""
+A local stand-in for the company listings site, used to test and benchmark
+web_scraper_test_solution without going over the network. It serves listing
+pages in the same markup as output.html and a page of details per company,
+can add latency to every request and fail requests on purpose, and answers
+conditional requests for unchanged pages with 304s.
+"""
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import hashlib
+import socket
+import threading
+import time
+import urllib
+import urlparse
+
+SURNAMES = ['Douglas', 'Walsh', 'Luettgen', 'Stehr', 'Beahan', 'Spencer', 'Torphy',
+            'Larkin', 'Ryan', 'Kulas', 'White', 'Weimann', 'Schmidt', 'Nitzsche',
+            'Leffler', 'Hahn', 'Botsford', 'Brown', 'West', 'Reichel', 'Keebler',
+            'Frami', 'Jacobson', 'Schowalter', 'Borer', 'Hilpert']
+
+LISTING_PAGE = '''<!DOCTYPE html>
+<html lang="en">
+    <head>
+        <meta charset="utf-8">
+        <title>enigma.io | html test</title>
+    </head>
+    <body>
+    <div class="container">
+    <div class="pagination-page-info">displaying <b>{first} - {last}</b> companies in
+total <b>{total}</b></div>
+    {pagination}
+    <div class="table-responsive">
+        <table class="table table-hover">
+            <thead>
+                <tr><th>#</th><th>Company Name</th></tr>
+            </thead>
+            <tbody>
+{rows}
+            </tbody>
+        </table>
+    </div>
+    {pagination}
+    </div>
+  </body>
+</html>
+'''
+
+LISTING_ROW = '''                <tr>
+                    <td>{number}</td>
+                    <td>
+                        <a id={number} href="/companies/{name}">
+                            {name}</a>
+                    </td>
+                </tr>
+'''
+
+COMPANY_PAGE = '''<!DOCTYPE html>
+<html lang="en">
+    <head>
+        <meta charset="utf-8">
+        <title>enigma.io | html test</title>
+    </head>
+    <body>
+    <div class="container">
+        <table class="table">
+            <tbody>
+{rows}
+            </tbody>
+        </table>
+    </div>
+  </body>
+</html>
+'''
+
+COMPANY_ROW = '''                <tr>
+                    <td><b>{key}</b></td>
+                    <td id="{id}">{value}</td>
+                </tr>
+'''
+
+
+def company_name(index):
+    "Returns a unique, realistic looking company name for an index"
+    count = len(SURNAMES)
+    first, second, third = index % count, index // count % count, index // count ** 2 % count
+    name = '{}, {} and {}'.format(SURNAMES[first], SURNAMES[second], SURNAMES[third])
+    if index >= count ** 3:
+        name += ' {}'.format(index // count ** 3)
+    return name
+
+
+def company_details(index):
+    "Returns the details shown on the page of the company with an index"
+    return [('Company Name', company_name(index)),
+            ('Address Line 1', '{} Terry Passage'.format(1000 + index)),
+            ('Address Line 2', 'Suite {:03d}'.format(index % 1000)),
+            ('City', 'Port Hellenport'),
+            ('State', 'Minnesota'),
+            ('Zipcode', '{:05d}'.format(index * 7 % 100000)),
+            ('Phone', '1-697-917-{:04d}'.format(index % 10000)),
+            ('Company Description', 'orchestrate efficient mindshare'),
+            ('Company Website', 'company{}.com'.format(index))]
+
+
+class FakeCompanySite():
+    """
+    Serves a fake company listings site from a local HTTP server on a free
+    port. Use it as a context manager, or call start and stop
+    """
+    def __init__(self, companies=100, per_page=10, latency=0.0, failures_per_page=0):
+        self.companies = companies
+        self.per_page = per_page
+        self.latency = latency  # Seconds to wait before answering each request
+        self.failures_per_page = failures_per_page  # 503s to send for each path first
+        self.failures = {}
+        self.last_modified = 'Thu, 01 Jan 2015 00:00:00 GMT'  # Every page's, unless changed
+        self.not_modified = 0  # Number of 304 responses sent
+        self.requests = 0
+        self.paths = []  # Every path requested, in order
+        self.connections = 0
+        self.in_flight = 0  # Requests being answered now
+        self.most_in_flight = 0  # The most requests ever answered at once
+        self.open_sockets = set()
+        self.lock = threading.Lock()
+        self.server = None
+        self.company_indices = {company_name(index): index for index in range(companies)}
+
+    @property
+    def pages(self):
+        return max(1, -(-self.companies // self.per_page))
+
+    @property
+    def url(self):
+        "The url of the first listing page"
+        return 'http://127.0.0.1:{}/companies/'.format(self.server.server_address[1])
+
+    def expected_json(self):
+        "Returns the json web_scrape should produce for the whole site"
+        result = {}
+        for index in range(self.companies):
+            details = dict(company_details(index))
+            result[details.pop('Company Name')] = details
+        return result
+
+    def pagination(self, page):
+        previous_item = '<li class="previous disabled unavailable"><a href="#"> &laquo; </a></li>'
+        items = [previous_item]
+        # Like the real site, only the first few and last couple of pages get links
+        numbers = sorted(set(range(1, 6) + [page, self.pages - 1, self.pages]))
+        numbers = [number for number in numbers if 1 <= number <= self.pages]
+        for i, number in enumerate(numbers):
+            if i and number > numbers[i - 1] + 1:
+                items.append('<li class="disabled"><a href="#">...</a></li>')
+            if number == page:
+                items.append('<li class="active"><a href="#">{}</a></li>'.format(number))
+            else:
+                items.append('<li><a href="/companies/?page={0}">{0}</a></li>'.format(number))
+        if page < self.pages:
+            items.append('<li class="next"><a href="/companies/?page={}">&raquo;</a></li>'
+                         .format(page + 1))
+        else:
+            items.append('<li class="next disabled unavailable"><a href="#">&raquo;</a></li>')
+        return '<ul class="pagination pagination-sm">{}</ul>'.format(''.join(items))
+
+    def listing_page(self, page):
+        first = (page - 1) * self.per_page
+        last = min(first + self.per_page, self.companies)
+        rows = ''.join(LISTING_ROW.format(number=index + 1, name=company_name(index))
+                       for index in range(first, last))
+        return LISTING_PAGE.format(first=first + 1, last=last, total=self.companies,
+                                   pagination=self.pagination(page), rows=rows)
+
+    def company_page(self, index):
+        rows = ''.join(COMPANY_ROW.format(key=key, id=key.lower().replace(' ', '_'), value=value)
+                       for key, value in company_details(index))
+        return COMPANY_PAGE.format(rows=rows)
+
+    def page_for_path(self, path):
+        "Returns the html for a request path, or None if there's no such page"
+        parsed = urlparse.urlparse(path)
+        if parsed.path == '/companies/':
+            page = int(urlparse.parse_qs(parsed.query).get('page', ['1'])[0])
+            if 1 <= page <= self.pages:
+                return self.listing_page(page)
+        elif parsed.path.startswith('/companies/'):
+            name = urllib.unquote(parsed.path[len('/companies/'):])
+            if name in self.company_indices:
+                return self.company_page(self.company_indices[name])
+        return None
+
+    def should_fail(self, path):
+        "Counts a request for a path, and returns whether it should be failed"
+        with self.lock:
+            self.requests += 1
+            self.paths.append(path)
+            failures = self.failures.get(path, 0)
+            if failures < self.failures_per_page:
+                self.failures[path] = failures + 1
+                return True
+        return False
+
+    def make_handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keeps connections alive between requests
+            # Send each response in one go, rather than stalling on Nagle's algorithm
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                with site.lock:
+                    site.connections += 1
+                    site.open_sockets.add(self.connection)
+
+            def finish(self):
+                BaseHTTPRequestHandler.finish(self)
+                with site.lock:
+                    site.open_sockets.discard(self.connection)
+
+            def do_GET(self):
+                with site.lock:
+                    site.in_flight += 1
+                    site.most_in_flight = max(site.most_in_flight, site.in_flight)
+                try:
+                    self.answer()
+                finally:
+                    with site.lock:
+                        site.in_flight -= 1
+
+            def answer(self):
+                time.sleep(site.latency)
+                if site.should_fail(self.path):
+                    self.send_page(503, 'Try again later')
+                    return
+                html = site.page_for_path(self.path)
+                if html is None:
+                    self.send_page(404, 'Not found')
+                    return
+                etag = '"{}"'.format(hashlib.md5(html).hexdigest())
+                # Like real servers, If-Modified-Since only counts without an If-None-Match
+                if_none_match = self.headers.get('If-None-Match')
+                if (if_none_match == etag if if_none_match else
+                        self.headers.get('If-Modified-Since') == site.last_modified):
+                    with site.lock:
+                        site.not_modified += 1
+                    self.send_page(304, '', etag)
+                else:
+                    self.send_page(200, html, etag)
+
+            def send_page(self, status, html, etag=None):
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(html)))
+                if etag:
+                    self.send_header('ETag', etag)
+                    self.send_header('Last-Modified', site.last_modified)
+                self.end_headers()
+                self.wfile.write(html)
+
+            def log_message(self, format, *args):
+                pass  # Keep test output quiet
+
+        return Handler
+
+    def start(self):
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+            # Room for many clients connecting at once, instead of their
+            # connections stalling for a second waiting to be retried
+            request_queue_size = 128
+
+        self.server = Server(('127.0.0.1', 0), self.make_handler())
+        thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        # Hang up on clients keeping connections alive, so their handlers finish
+        with self.lock:
+            for open_socket in self.open_sockets:
+                try:
+                    open_socket.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,6 +1,455 @@
 from bs4 import BeautifulSoup
+from multiprocessing.pool import ThreadPool
+import argparse
+import collections
+import contextlib
+import HTMLParser
+import httplib
 import json
+import os
+import random
+import socket
+import sqlite3
+import sys
+import threading
+import time
 import urllib2
+import urlparse
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None  # Fast extraction falls back on the standard library's parser
+
+
+class FetchError(Exception):
+    """
+    Raised when a page can't be fetched. Errors that are worth retrying,
+    like timeouts and 5xx responses, are marked as transient
+    """
+    def __init__(self, message, transient=False):
+        Exception.__init__(self, message)
+        self.transient = transient
+
+
+class HostRateLimiter():
+    """
+    Spaces out the requests made to each host so that no more than
+    requests_per_second of them are started, or does nothing if
+    requests_per_second is None
+    """
+    def __init__(self, requests_per_second=None):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0
+        self.next_start_times = {}
+        self.lock = threading.Lock()
+
+    def wait(self, host):
+        "Blocks until the next request to the host is allowed to start"
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_start_times.get(host, 0))
+            self.next_start_times[host] = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class ResponseCache():
+    """
+    A persistent cache of fetched pages, kept in an SQLite database and keyed
+    by url. Along with each page's body it keeps the ETag and Last-Modified
+    headers it was sent with, when it was fetched, and the result of parsing
+    it, so that a page that hasn't changed needn't be parsed again.
+    Pages fetched less than ttl seconds ago are used without asking the
+    server, and older ones are revalidated with a conditional request.
+    Pages fetched more than max_age seconds ago are evicted, as are the
+    oldest pages whenever the bodies take up more than max_bytes
+    """
+    def __init__(self, filename, ttl=0, max_bytes=None, max_age=None):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0  # Pages used without a request
+        self.revalidated = 0  # Pages the server said were unchanged
+        self.misses = 0  # Pages that had to be downloaded
+        self.lock = threading.Lock()
+        # Shared between the fetcher's threads, with the lock around every use
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'url TEXT PRIMARY KEY, body BLOB, etag TEXT, last_modified TEXT, '
+                'fetched_at REAL, size INTEGER, parsed TEXT)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS responses_fetched_at ON responses (fetched_at)')
+            self.total_bytes = self.connection.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get(self, url):
+        """
+        Returns a dict of the cached body, etag, last_modified and
+        fetched_at for a url, or None if it isn't cached
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT body, etag, last_modified, fetched_at FROM responses WHERE url = ?',
+                (url,)).fetchone()
+        if row is None:
+            return None
+        return {'body': str(row[0]), 'etag': row[1], 'last_modified': row[2],
+                'fetched_at': row[3]}
+
+    def is_fresh(self, entry):
+        "Returns whether a cached entry can be used without revalidating it"
+        return time.time() - entry['fetched_at'] < self.ttl
+
+    def store(self, url, body, etag=None, last_modified=None):
+        "Caches a newly downloaded page, forgetting how it was parsed before"
+        with self.lock, self.connection:
+            old_size = self.connection.execute(
+                'SELECT size FROM responses WHERE url = ?', (url,)).fetchone()
+            self.connection.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, NULL)',
+                (url, sqlite3.Binary(body), etag, last_modified, time.time(), len(body)))
+            self.total_bytes += len(body) - (old_size[0] if old_size else 0)
+            self.evict()
+
+    def refresh(self, url):
+        "Marks a cached page as just revalidated"
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE responses SET fetched_at = ? WHERE url = ?',
+                                    (time.time(), url))
+
+    def evict(self):
+        """
+        Drops expired pages, then the oldest ones until the cache is small
+        enough. total_bytes is kept up to date as pages go, so this only
+        looks at the pages being dropped, using the index on fetched_at
+        """
+        if self.max_age is not None:
+            cutoff = time.time() - self.max_age
+            self.total_bytes -= self.connection.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM responses WHERE fetched_at < ?',
+                (cutoff,)).fetchone()[0]
+            self.connection.execute('DELETE FROM responses WHERE fetched_at < ?', (cutoff,))
+        if self.max_bytes is not None:
+            while self.total_bytes > self.max_bytes:
+                url, size = self.connection.execute(
+                    'SELECT url, size FROM responses ORDER BY fetched_at LIMIT 1').fetchone()
+                self.connection.execute('DELETE FROM responses WHERE url = ?', (url,))
+                self.total_bytes -= size
+
+    def get_parsed(self, url):
+        "Returns what was stored with set_parsed for a url, or None"
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT parsed FROM responses WHERE url = ?', (url,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def set_parsed(self, url, parsed):
+        "Stores the json serializable result of parsing a cached page"
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE responses SET parsed = ? WHERE url = ?',
+                                    (json.dumps(parsed), url))
+
+    def count(self, outcome):
+        "Adds one to the hits, revalidated or misses counter, from any thread"
+        with self.lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def stats(self):
+        "Returns the cache's counters as a dict"
+        with self.lock:
+            return {'hits': self.hits, 'revalidated': self.revalidated,
+                    'misses': self.misses, 'bytes': self.total_bytes}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class ScrapeStats():
+    """
+    Thread safe counters and timers for a scrape: the pages done, requests
+    made and bytes fetched, the seconds spent fetching, parsing and
+    serializing (summed over every thread), a bounded sample of request
+    latencies for percentiles, and counts of retries and errors. Every update
+    takes constant time and memory. Every progress_every company pages, the
+    on_progress callback is called with the stats
+    """
+    latency_sample_size = 10000
+
+    def __init__(self, on_progress=None, progress_every=10):
+        self.on_progress = on_progress
+        self.progress_every = progress_every
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.pages = collections.Counter()  # Pages done, by 'listing' or 'company'
+        self.requests = 0
+        self.bytes = 0
+        self.phase_seconds = collections.OrderedDict(
+            (phase, 0.0) for phase in ('fetch', 'parse', 'serialize'))
+        self.latencies = []  # A uniform sample of request latencies, in seconds
+        self.random = random.Random(0)
+        self.retries = 0
+        self.errors = collections.Counter()  # Failed fetches, by 'transient' or 'permanent'
+
+    def record_fetch(self, seconds, size):
+        "Counts a request, including its retries, that took seconds and got size bytes"
+        with self.lock:
+            self.requests += 1
+            self.bytes += size
+            self.phase_seconds['fetch'] += seconds
+            # Reservoir sampling keeps the sample uniform over every request
+            if len(self.latencies) < self.latency_sample_size:
+                self.latencies.append(seconds)
+            else:
+                index = self.random.randrange(self.requests)
+                if index < self.latency_sample_size:
+                    self.latencies[index] = seconds
+
+    def record_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def record_error(self, error):
+        with self.lock:
+            self.errors['transient' if error.transient else 'permanent'] += 1
+
+    @contextlib.contextmanager
+    def timed(self, phase):
+        "Adds the time spent in a with block to a phase"
+        start = time.time()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phase_seconds[phase] += time.time() - start
+
+    def page_done(self, kind):
+        "Counts a 'listing' or 'company' page, reporting progress as due"
+        with self.lock:
+            self.pages[kind] += 1
+            report = kind == 'company' and self.pages[kind] % self.progress_every == 0
+        if report and self.on_progress:
+            self.on_progress(self)
+
+    def pages_per_second(self):
+        elapsed = time.time() - self.started
+        return sum(self.pages.values()) / elapsed if elapsed else 0.0
+
+    def latency_percentiles(self, percentiles=(50, 90, 99)):
+        "Returns a dict of latency percentiles in milliseconds, from the sample"
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return {}
+        result = collections.OrderedDict()
+        for percentile in percentiles:
+            index = min(len(latencies) - 1, int(len(latencies) * percentile / 100.0))
+            result['p{}'.format(percentile)] = latencies[index] * 1000
+        result['max'] = latencies[-1] * 1000
+        return result
+
+    def summary(self):
+        "Returns the stats as a json serializable dict"
+        elapsed = time.time() - self.started
+        return collections.OrderedDict([
+            ('elapsed_seconds', elapsed),
+            ('listing_pages', self.pages['listing']),
+            ('company_pages', self.pages['company']),
+            ('pages_per_second', self.pages_per_second()),
+            ('requests', self.requests),
+            ('bytes_fetched', self.bytes),
+            ('bytes_per_second', self.bytes / elapsed if elapsed else 0.0),
+            ('phase_seconds', self.phase_seconds),
+            ('latency_ms', self.latency_percentiles()),
+            ('retries', self.retries),
+            ('errors', dict(self.errors))])
+
+
+def print_progress(stats):
+    "The default progress callback for ScrapeStats"
+    print 'Processed {} company urls ({:.1f} pages/sec)...'.format(
+        stats.pages['company'], stats.pages_per_second())
+
+
+class Fetcher():
+    """
+    Fetches pages over HTTP, with up to concurrency requests in flight when
+    fetching many at once with fetch_all. Each thread keeps its connection to
+    each host open between requests, requests to each host are rate limited,
+    and transient failures are retried with exponential backoff. Given a
+    ResponseCache, pages are fetched through it. Requests are counted in
+    stats, a ScrapeStats
+    """
+    max_redirects = 5
+
+    def __init__(self, concurrency=8, requests_per_second=None, retries=3,
+                 backoff=0.5, timeout=10, cache=None, stats=None):
+        self.concurrency = concurrency
+        self.cache = cache
+        self.stats = stats or ScrapeStats(print_progress)
+        self.rate_limiter = HostRateLimiter(requests_per_second)
+        self.retries = retries
+        self.backoff = backoff  # Seconds to wait before the first retry
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def get_connection(self, scheme, netloc):
+        "Returns this thread's open connection to a host, making it if need be"
+        connections = self.local.__dict__.setdefault('connections', {})
+        if (scheme, netloc) not in connections:
+            if scheme == 'https':
+                connection = httplib.HTTPSConnection(netloc, timeout=self.timeout)
+            else:
+                connection = httplib.HTTPConnection(netloc, timeout=self.timeout)
+            connections[(scheme, netloc)] = connection
+        return connections[(scheme, netloc)]
+
+    def drop_connection(self, scheme, netloc):
+        "Closes this thread's connection to a host, if it has one"
+        connection = self.local.__dict__.get('connections', {}).pop((scheme, netloc), None)
+        if connection:
+            connection.close()
+
+    def request(self, url, headers=None):
+        """
+        Makes a single attempt at fetching a url, and returns the
+        response along with its body
+        """
+        for _ in range(self.max_redirects + 1):
+            parsed = urlparse.urlsplit(url)
+            path = urlparse.urlunsplit(('', '', parsed.path or '/', parsed.query, ''))
+            self.rate_limiter.wait(parsed.netloc)
+            connection = self.get_connection(parsed.scheme, parsed.netloc)
+            try:
+                connection.request('GET', path, headers=headers or {})
+                response = connection.getresponse()
+                body = response.read()
+            except (httplib.HTTPException, socket.error) as error:
+                # The connection can't be trusted after this, so start a new one next time
+                self.drop_connection(parsed.scheme, parsed.netloc)
+                raise FetchError('Failed to fetch {}: {!r}'.format(url, error), transient=True)
+
+            if response.status in (301, 302, 303, 307, 308):
+                url = urlparse.urljoin(url, response.getheader('location'))
+            elif response.status >= 400:
+                raise FetchError('Failed to fetch {}: HTTP {}'.format(url, response.status),
+                                 transient=response.status >= 500)
+            else:
+                return response, body
+        raise FetchError('Too many redirects fetching {}'.format(url))
+
+    def request_with_retries(self, url, headers=None):
+        "Calls request, retrying transient failures"
+        start = time.time()
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                response, body = self.request(url, headers)
+            except FetchError as error:
+                if not error.transient or attempt == self.retries:
+                    self.stats.record_error(error)
+                    raise
+                self.stats.record_retry()
+            else:
+                self.stats.record_fetch(time.time() - start, len(body))
+                return response, body
+            time.sleep(delay)
+            delay *= 2
+
+    def fetch_page(self, url):
+        """
+        Fetches a url, and returns its body along with whether the page is
+        unchanged since it was cached
+        """
+        cache = self.cache
+        if cache is None:
+            return self.request_with_retries(url)[1], False
+
+        entry = cache.get(url)
+        headers = {}
+        if entry:
+            if cache.is_fresh(entry):
+                cache.count('hits')
+                return entry['body'], True
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response, body = self.request_with_retries(url, headers)
+        if entry and response.status == 304:
+            cache.count('revalidated')
+            cache.refresh(url)
+            return entry['body'], True
+        cache.count('misses')
+        cache.store(url, body, response.getheader('etag'), response.getheader('last-modified'))
+        return body, False
+
+    def fetch(self, url):
+        "Fetches a url, and returns the body"
+        return self.fetch_page(url)[0]
+
+    def fetch_with_url(self, url):
+        return (url,) + self.fetch_page(url)
+
+    def fetch_all(self, urls):
+        """
+        Fetches an iterable of urls from a pool of threads, and generates
+        (url, body, unchanged) tuples in the order they finish, where
+        unchanged is whether the page is the same as when it was cached.
+        The urls are pulled from the iterable as it produces them, so it can
+        be a generator that's still doing work of its own
+        """
+        errors = []
+
+        def guarded_urls():
+            # An error raised by the iterable inside the pool would hang it,
+            # so keep the error to raise here once the pool has finished
+            try:
+                for url in urls:
+                    yield url
+            except Exception:
+                errors.append(sys.exc_info())
+
+        pool = ThreadPool(self.concurrency)
+        try:
+            for result in pool.imap_unordered(self.fetch_with_url, guarded_urls()):
+                yield result
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+
+
+# Used by get_soup when it isn't given a fetcher
+default_fetcher = Fetcher(concurrency=1)
+
+
+def parse_page(url, html, unchanged, parse, fetcher):
+    """
+    Returns the result of calling parse on a page's html, timed in the
+    fetcher's stats. When the page is unchanged since it was put in the
+    fetcher's cache, the result of parsing it last time is used instead of
+    parsing it again
+    """
+    cache = fetcher.cache
+    with fetcher.stats.timed('parse'):
+        if unchanged and cache:
+            parsed = cache.get_parsed(url)
+            if parsed is not None:
+                return parsed
+        parsed = parse(html)
+        if cache:
+            cache.set_parsed(url, parsed)
+        return parsed
 
 
 def get_url_without_path(url):
@@ -15,14 +464,18 @@ def get_url_without_path(url):
     return False
 
 
-def get_soup(url):
+def make_soup(html):
+    "Takes the html of a page and returns a BeautifulSoup object for it"
+    return BeautifulSoup(html)
+
+
+def get_soup(url, fetcher=None):
     """
     Takes a url as a string and returns a BeautifulSoup object
-    ready for html parsing
+    ready for html parsing, fetching it with the given Fetcher
     """
-    response = urllib2.urlopen(url)
-    html = response.read()
-    return BeautifulSoup(html)
+    html = (fetcher or default_fetcher).fetch(url)
+    return make_soup(html)
 
 
 def parse_table_rows_for_company_data(soup):
@@ -89,55 +542,305 @@ def get_company_paths_on_page(soup):
     return [parse_td_link_for_company_path(td) for td in page_tds]
 
 
-def web_scrape(url, output_filename):
-    "Main function for scraping the site for company data"
+def parse_listing_page(soup):
+    """
+    Takes the soup object of a company listing page and returns the company
+    paths on it along with the path to the next page
+    """
+    return get_company_paths_on_page(soup), get_path_to_next_page(soup)
+
+
+class PageExtractor():
+    """
+    Pulls the company paths, the path to the next page and the company data
+    rows out of a page in a single pass over its parser events, without
+    building a tree. It finds what get_company_paths_on_page,
+    get_path_to_next_page and parse_table_rows_for_company_data find in a
+    soup. Its start, end, data and close methods make it a parser target
+    for lxml, and StreamingPageParser feeds it from HTMLParser otherwise
+    """
+    def __init__(self):
+        self.company_paths = []
+        self.next_path = ''
+        self.rows = {}
+        self.in_next_li = False  # Inside the first li with just the 'next' class
+        self.found_next = False
+        self.cell = None  # Text of the td being read
+        self.cell_has_link = False
+        self.cell_bold = None  # Text of the first b in the td being read
+        self.bold = None  # Text of the b being read
+        self.row_cells = None  # (text, bold text) of each td in the tr being read
+
+    def start(self, tag, attrs):
+        if tag == 'a':
+            href = attrs.get('href')
+            if self.cell is not None and not self.cell_has_link:
+                self.cell_has_link = True
+                # Replace white space with chars readable by the url lib
+                self.company_paths.append('%20'.join((href or '').split(' ')))
+            if self.in_next_li:
+                self.next_path = href
+                self.in_next_li = False
+                self.found_next = True
+        elif tag == 'td':
+            self.cell = []
+            self.cell_has_link = False
+            self.cell_bold = None
+        elif tag == 'b' and self.cell is not None and self.cell_bold is None:
+            self.bold = []
+        elif tag == 'tr':
+            self.row_cells = []
+        elif tag == 'li' and not self.found_next:
+            self.in_next_li = (attrs.get('class') or '').split() == ['next']
+
+    def end(self, tag):
+        if tag == 'b' and self.bold is not None:
+            self.cell_bold = ''.join(self.bold)
+            self.bold = None
+        elif tag == 'td' and self.cell is not None:
+            if self.row_cells is not None:
+                self.row_cells.append((''.join(self.cell), self.cell_bold))
+            self.cell = None
+        elif tag == 'tr' and self.row_cells is not None:
+            cells = self.row_cells
+            if len(cells) >= 2 and cells[0][1] is not None:
+                self.rows[str(cells[0][1])] = str(cells[1][0])
+            self.row_cells = None
+        elif tag == 'li':
+            self.in_next_li = False
+
+    def data(self, text):
+        if self.cell is not None:
+            self.cell.append(text)
+            if self.bold is not None:
+                self.bold.append(text)
+
+    def close(self):
+        return self
 
+
+class StreamingPageParser(HTMLParser.HTMLParser):
+    "Feeds the events of the standard library's HTML parser to a PageExtractor"
+    def __init__(self, extractor):
+        HTMLParser.HTMLParser.__init__(self)
+        self.extractor = extractor
+
+    def handle_starttag(self, tag, attrs):
+        self.extractor.start(tag, dict(attrs))
+
+    def handle_endtag(self, tag):
+        self.extractor.end(tag)
+
+    def handle_data(self, data):
+        self.extractor.data(data)
+
+    def handle_entityref(self, name):
+        self.extractor.data(self.unescape('&{};'.format(name)))
+
+    def handle_charref(self, name):
+        self.extractor.data(self.unescape('&#{};'.format(name)))
+
+
+def extract_page(html, use_lxml=True):
+    """
+    Takes the html of a page and returns a PageExtractor holding its
+    company paths, next page path and company data rows, parsed with lxml
+    if it's installed
+    """
+    extractor = PageExtractor()
+    if use_lxml and etree is not None:
+        return etree.fromstring(html, etree.HTMLParser(target=extractor))
+    parser = StreamingPageParser(extractor)
+    parser.feed(html)
+    parser.close()
+    return extractor
+
+
+def parse_listing_html(html):
+    return parse_listing_page(make_soup(html))
+
+
+def parse_company_html(html):
+    return parse_table_rows_for_company_data(make_soup(html))
+
+
+def fast_parse_listing_html(html):
+    "Like parse_listing_html, but with extract_page rather than a soup"
+    page = extract_page(html)
+    return page.company_paths, page.next_path
+
+
+def fast_parse_company_html(html):
+    "Like parse_company_html, but with extract_page rather than a soup"
+    return extract_page(html).rows
+
+
+def iter_company_paths(url, fetcher=None, fast=False):
+    """
+    Walks the company listing pages from the given url by following each
+    page's "next" link, and generates the company paths found on each page
+    as soon as that page has been parsed
+    """
+    fetcher = fetcher or default_fetcher
+    parse = fast_parse_listing_html if fast else parse_listing_html
     base_url = get_url_without_path(url)  # Used to complete a url when we only have a path
+    visited_pages = set()  # Used to prevent an infinite loop
+    while url and url not in visited_pages:
+        html, unchanged = fetcher.fetch_page(url)
+        visited_pages.add(url)
+        paths, new_path = parse_page(url, html, unchanged, parse, fetcher)
+        fetcher.stats.page_done('listing')
+        for path in paths:
+            yield path
+        url = base_url + new_path if new_path else None
+
+
+def iter_unique(iterable):
+    "Generates the items of an iterable, skipping any already seen"
+    seen = set()
+    for item in iterable:
+        if item not in seen:
+            seen.add(item)
+            yield item
+
 
-    def recurse_path_finder(url, result=[], visited_pages=[]):
+class CompanyRecordWriter():
+    """
+    Appends each company's data to a JSON Lines file as soon as it's been
+    parsed, as one {"url", "name", "data"} object per line, so a crash loses
+    at most the company being written. When resuming, the companies already
+    in the file are kept, and their urls are remembered in done_urls so they
+    can be skipped
+    """
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self.done_urls = set()
+        mode = 'wb'
+        if resume and os.path.exists(filename):
+            self.done_urls, end = self.read_done_urls(filename)
+            # Drop any record left half written by a crash
+            with open(filename, 'r+b') as records:
+                records.truncate(end)
+            mode = 'ab'
+        self.records = open(filename, mode)
+
+    @staticmethod
+    def read_done_urls(filename):
         """
-        Adds the company paths on the given url to it's result list,
-        and then searches for a "next" link on the page. It then calls itself if it
-        finds a link using the new url as input, or returns the result list if it doesn't
+        Returns the set of company urls in a records file, along with the
+        offset just past its last complete record
         """
-        soup = get_soup(url)
-        visited_pages.append(url)  # Used to prevent an infinite loop
-        result.extend(get_company_paths_on_page(soup))
-        new_path = get_path_to_next_page(soup)
-        new_url = base_url + new_path
-        if new_path and new_url not in visited_pages:
-            return recurse_path_finder(new_url, result)
-        else:
-            return result
-
-    # Execute the recursive call to get every company page url
+        urls = set()
+        end = 0
+        with open(filename, 'rb') as records:
+            for line in records:
+                if not line.endswith('\n'):
+                    break
+                try:
+                    urls.add(json.loads(line)['url'])
+                except ValueError:
+                    break
+                end += len(line)
+        return urls, end
+
+    def write(self, url, name, data):
+        self.records.write(json.dumps({'url': url, 'name': name, 'data': data}))
+        self.records.write('\n')
+        self.records.flush()
+
+    def close(self):
+        self.records.close()
+
+
+def write_company_json(records_filename, output_filename):
+    """
+    Writes the companies in a records file to a json object of company names
+    and their data, formatted like json.dump with an indent of 4, without
+    loading them all into memory. Like building a dict of them would, only
+    the last record for each name is kept, so the object has no repeated
+    keys. Only the offset of each name's last record is held in memory
+    """
+    last_offsets = {}
+    with open(records_filename, 'rb') as records:
+        offset = 0
+        for line in records:
+            last_offsets[json.loads(line)['name']] = offset
+            offset += len(line)
+    last_offsets = set(last_offsets.itervalues())
+
+    with open(records_filename, 'rb') as records, \
+            open(output_filename, 'wb') as json_solution:
+        json_solution.write('{')
+        separator = '\n'
+        offset = 0
+        for line in records:
+            offset += len(line)
+            if offset - len(line) not in last_offsets:
+                continue  # A later record has the same name
+            record = json.loads(line)
+            # Strip the braces from a one company object to get its entry
+            entry = json.dumps({record['name']: record['data']}, indent=4)[2:-2]
+            json_solution.write(separator + entry)
+            separator = ', \n'
+        json_solution.write('\n}' if separator != '\n' else '}')
+
+
+def web_scrape(url, output_filename, fetcher=None, fast=False, resume=False):
+    """
+    Main function for scraping the site for company data. The company
+    pages are fetched concurrently with the given Fetcher, or a new one
+    with the default settings. In fast mode pages are parsed with
+    extract_page instead of BeautifulSoup.
+
+    Each company is written to a JSON Lines file as it's parsed: the output
+    itself if its name ends in .jsonl, or else a temporary file next to it
+    that's turned into a json object once every company is done. When
+    resuming, companies already in that file aren't fetched again.
+
+    Progress is reported through the fetcher's stats, and a summary of
+    them is returned
+    """
+    if fetcher is None:
+        fetcher = Fetcher()
+    stats = fetcher.stats
+    base_url = get_url_without_path(url)  # Used to complete a url when we only have a path
+
+    # The listing pages are walked while the company pages are being fetched,
+    # so a company url is handed to the fetcher as soon as it's found
     print 'Collecting urls to company pages...'
-    company_urls = [base_url+path for path in recurse_path_finder(url)]
-    company_urls = list(set(company_urls))  # Get rid of duplicates
-    total_companies = len(company_urls)  # Used to print progress updates
+    company_urls = iter_unique(base_url + path
+                               for path in iter_company_paths(url, fetcher, fast))
 
-    json_result = {}  # A json dict with company names as keys and their data as values
+    jsonl = output_filename.endswith('.jsonl')
+    records_filename = output_filename if jsonl else output_filename + '.jsonl'
+    writer = CompanyRecordWriter(records_filename, resume)
+    if writer.done_urls:
+        print 'Skipping {} companies already scraped...'.format(len(writer.done_urls))
+        company_urls = (url for url in company_urls if url not in writer.done_urls)
     name_string = 'Company Name'
 
-    # Finally, loop over the company urls and retrieve their data, compiling it
-    # into a json object
-    for url in company_urls:
-        # Print a progress update once for every ten urls processed
-        index = company_urls.index(url)
-        if (company_urls.index(url) % 10 == 9):
-            print 'Processing company url {} of {}...'.format(index+1, total_companies)
-
-        # Parse and process the table rows for the company urls, building
-        # the final result
-        soup = get_soup(url)
-        rows = parse_table_rows_for_company_data(soup)
-        rows_without_company_name = {key: value for key, value in rows.items()
-                                     if key != name_string}
-        json_result[rows[name_string]] = rows_without_company_name
+    # Fetch the company pages concurrently and write their data out as
+    # they arrive
+    try:
+        for url, html, unchanged in fetcher.fetch_all(company_urls):
+            # Parse and process the table rows for the company urls
+            rows = parse_page(url, html, unchanged,
+                              fast_parse_company_html if fast else parse_company_html,
+                              fetcher)
+            rows_without_company_name = {key: value for key, value in rows.items()
+                                         if key != name_string}
+            with stats.timed('serialize'):
+                writer.write(url, rows[name_string], rows_without_company_name)
+            stats.page_done('company')
+    finally:
+        writer.close()
 
     # Write the result to a file
-    with open(output_filename, 'wb') as json_solution:
-        json.dump(json_result, json_solution, indent=4)
+    if not jsonl:
+        with stats.timed('serialize'):
+            write_company_json(records_filename, output_filename)
+        os.remove(records_filename)
+    return stats.summary()
 
 
 if __name__ == '__main__':
@@ -163,9 +866,292 @@ if __name__ == '__main__':
             # NOTE: Removed tests that rely on local HTML to
             #       manipulate BeutifulSoup objects
 
+        class FetcherTest(unittest.TestCase):
+            def scrape(self, site, fetcher):
+                import os
+                import tempfile
+                output_filename = os.path.join(tempfile.mkdtemp(), 'solution.json')
+                web_scrape(site.url, output_filename, fetcher)
+                with open(output_filename) as json_solution:
+                    return json.load(json_solution)
+
+            def test_web_scrape_local_site(self):
+                with FakeCompanySite(companies=25, per_page=10) as site:
+                    result = self.scrape(site, Fetcher(concurrency=4))
+                    self.assertEqual(result, site.expected_json())
+                    # Kept alive connections mean far fewer connections than requests
+                    self.assertTrue(site.connections <= 5)
+
+            def test_concurrent_fetching_overlaps_requests(self):
+                # Parsing is one page at a time, so timings would only be a guide
+                from fake_company_site import company_name
+                for concurrency in (1, 8):
+                    with FakeCompanySite(companies=40, latency=0.02) as site:
+                        urls = [site.url + urllib2.quote(company_name(index))
+                                for index in range(40)]
+                        fetched = list(Fetcher(concurrency=concurrency).fetch_all(urls))
+                    self.assertEqual(len(fetched), 40)
+                    if concurrency == 1:
+                        self.assertEqual(site.most_in_flight, 1)
+                    else:
+                        self.assertTrue(1 < site.most_in_flight <= concurrency)
+
+            def test_fetcher_retries_transient_failures(self):
+                with FakeCompanySite(companies=5, failures_per_page=2) as site:
+                    html = Fetcher(retries=2, backoff=0.01).fetch(site.url)
+                    self.assertTrue('Company Name' in html)
+                    with self.assertRaises(FetchError):
+                        Fetcher(retries=1, backoff=0.01).fetch(site.url + '?page=1')
+                    with self.assertRaises(FetchError):
+                        Fetcher().fetch(site.url + 'No%20such%20company')
+
+            def test_iter_company_paths_walks_long_chains(self):
+                # Far more pages than the recursion limit would have allowed
+                recursion_limit = sys.getrecursionlimit()
+                sys.setrecursionlimit(150)
+                try:
+                    with FakeCompanySite(companies=300, per_page=1) as site:
+                        paths = list(iter_company_paths(site.url, Fetcher()))
+                finally:
+                    sys.setrecursionlimit(recursion_limit)
+                self.assertEqual(len(paths), 300)
+                self.assertEqual(paths[0], '/companies/Douglas,%20Douglas%20and%20Douglas')
+
+            def test_company_pages_fetched_while_walking_listings(self):
+                with FakeCompanySite(companies=30, per_page=5, latency=0.01) as site:
+                    self.scrape(site, Fetcher(concurrency=4))
+                    last_listing = max(i for i, path in enumerate(site.paths) if '?page=' in path)
+                    first_company = min(i for i, path in enumerate(site.paths) if '?page=' not in path
+                                        and path != '/companies/')
+                    self.assertTrue(first_company < last_listing)
+
+            def test_response_cache_revalidates_unchanged_pages(self):
+                import os
+                import tempfile
+                cache_filename = os.path.join(tempfile.mkdtemp(), 'cache.sqlite')
+                with FakeCompanySite(companies=12, per_page=5) as site:
+                    cache = ResponseCache(cache_filename)
+                    first = self.scrape(site, Fetcher(cache=cache))
+                    self.assertEqual(cache.stats()['misses'], 15)
+                    cache.close()
+
+                    cache = ResponseCache(cache_filename)
+                    second = self.scrape(site, Fetcher(cache=cache))
+                    self.assertEqual(first, second)
+                    self.assertEqual(cache.stats()['revalidated'], 15)
+                    self.assertEqual(site.not_modified, 15)
+
+                    cache.ttl = 60  # Fresh pages don't need a request at all
+                    requests = site.requests
+                    self.assertEqual(self.scrape(site, Fetcher(cache=cache)), first)
+                    self.assertEqual(cache.stats()['hits'], 15)
+                    self.assertEqual(site.requests, requests)
+
+            def test_response_cache_evicts_oldest_pages(self):
+                import os
+                import tempfile
+                cache = ResponseCache(os.path.join(tempfile.mkdtemp(), 'cache.sqlite'),
+                                      max_bytes=25)
+                for i in range(4):
+                    cache.store('http://example.com/{}'.format(i), 'x' * 10)
+                self.assertEqual(cache.total_bytes, 20)
+                self.assertEqual(cache.get('http://example.com/1'), None)
+                self.assertEqual(cache.get('http://example.com/3')['body'], 'x' * 10)
+
+                # Expired pages are taken off the running total as they go
+                cache.max_age = 60
+                with cache.connection:
+                    cache.connection.execute(
+                        'UPDATE responses SET fetched_at = 0 WHERE url LIKE ?', ('%/2',))
+                cache.store('http://example.com/4', 'y' * 5)
+                self.assertEqual(cache.total_bytes, 15)
+                self.assertEqual(cache.get('http://example.com/2'), None)
+                self.assertEqual(cache.connection.execute(
+                    'SELECT SUM(size) FROM responses').fetchone()[0], 15)
+
+            def test_response_cache_counts_from_many_threads(self):
+                import os
+                import tempfile
+                cache = ResponseCache(os.path.join(tempfile.mkdtemp(), 'cache.sqlite'))
+                threads = [threading.Thread(target=lambda: [cache.count('hits')
+                                                            for _ in range(10000)])
+                           for _ in range(8)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(cache.stats()['hits'], 80000)
+
+            def test_fast_extraction_matches_soup(self):
+                with open('output.html') as html_file:
+                    pages = [html_file.read()]
+                site = FakeCompanySite(companies=30, per_page=10)
+                pages += [site.listing_page(1), site.listing_page(3), site.company_page(7)]
+                pages.append(site.company_page(8).replace('Suite', 'Suite &amp; &#35;'))
+                for html in pages:
+                    soup = make_soup(html)
+                    for use_lxml in (True, False):
+                        page = extract_page(html, use_lxml)
+                        self.assertEqual(page.company_paths, get_company_paths_on_page(soup))
+                        self.assertEqual(page.next_path, get_path_to_next_page(soup))
+                        if 'Company Website' in html:
+                            self.assertEqual(page.rows, parse_table_rows_for_company_data(soup))
+                self.assertEqual(extract_page(pages[0]).next_path, '/companies/?page=2')
+
+            def test_web_scrape_fast_mode(self):
+                import os
+                import tempfile
+                output_filename = os.path.join(tempfile.mkdtemp(), 'solution.json')
+                with FakeCompanySite(companies=25, per_page=10) as site:
+                    web_scrape(site.url, output_filename, Fetcher(concurrency=4), fast=True)
+                    with open(output_filename) as json_solution:
+                        self.assertEqual(json.load(json_solution), site.expected_json())
+
+            def test_web_scrape_streams_and_resumes_jsonl(self):
+                import os
+                import tempfile
+                output_filename = os.path.join(tempfile.mkdtemp(), 'solution.jsonl')
+                with FakeCompanySite(companies=12, per_page=5) as site:
+                    web_scrape(site.url, output_filename, Fetcher(concurrency=1))
+                    with open(output_filename) as records:
+                        lines = records.readlines()
+                    self.assertEqual(len(lines), 12)
+
+                    # Lose the last three companies and leave one half written
+                    with open(output_filename, 'wb') as records:
+                        records.writelines(lines[:9])
+                        records.write(lines[9][:20])
+                    requests = site.requests
+                    web_scrape(site.url, output_filename, Fetcher(concurrency=1), resume=True)
+                    self.assertEqual(site.requests - requests, 3 + 3)  # Listings and companies
+
+                    with open(output_filename) as records:
+                        result = [json.loads(line) for line in records]
+                    self.assertEqual(len(result), 12)
+                    self.assertEqual({record['name']: record['data'] for record in result},
+                                     site.expected_json())
+
+            def test_write_company_json_matches_json_dump(self):
+                import os
+                import tempfile
+                temp_dir = tempfile.mkdtemp()
+                records_filename = os.path.join(temp_dir, 'records.jsonl')
+                output_filename = os.path.join(temp_dir, 'solution.json')
+                for companies in ({}, {'A': {'City': 'B', 'State': 'C'}}):
+                    writer = CompanyRecordWriter(records_filename)
+                    for name, data in companies.items():
+                        writer.write('http://example.com/' + name, name, data)
+                    writer.close()
+                    write_company_json(records_filename, output_filename)
+                    with open(output_filename) as json_solution:
+                        self.assertEqual(json_solution.read(), json.dumps(companies, indent=4))
+
+            def test_write_company_json_keeps_last_of_repeated_names(self):
+                import os
+                import tempfile
+                temp_dir = tempfile.mkdtemp()
+                records_filename = os.path.join(temp_dir, 'records.jsonl')
+                output_filename = os.path.join(temp_dir, 'solution.json')
+                writer = CompanyRecordWriter(records_filename)
+                writer.write('http://example.com/1', 'A', {'City': 'Old'})
+                writer.write('http://example.com/2', 'B', {'City': 'Other'})
+                writer.write('http://example.com/3', 'A', {'City': 'New'})
+                writer.close()
+                write_company_json(records_filename, output_filename)
+                with open(output_filename) as json_solution:
+                    text = json_solution.read()
+                self.assertEqual(text.count('"A"'), 1)
+                self.assertEqual(json.loads(text), {'A': {'City': 'New'}, 'B': {'City': 'Other'}})
+
+            def test_scrape_stats(self):
+                progress = []
+                stats = ScrapeStats(lambda stats: progress.append(stats.pages['company']),
+                                    progress_every=5)
+                with FakeCompanySite(companies=12, per_page=5, failures_per_page=1) as site:
+                    fetcher = Fetcher(concurrency=2, backoff=0.001, stats=stats)
+                    self.assertEqual(self.scrape(site, fetcher), site.expected_json())
+                    with self.assertRaises(FetchError):
+                        fetcher.fetch(site.url + 'No%20such%20company')
+                summary = json.loads(json.dumps(stats.summary()))
+                self.assertEqual(progress, [5, 10])
+                self.assertEqual((summary['listing_pages'], summary['company_pages']), (3, 12))
+                self.assertEqual(summary['requests'], 15)
+                self.assertEqual(summary['retries'], 16)  # Including the missing company
+                self.assertEqual(summary['errors'], {'permanent': 1})
+                self.assertTrue(summary['bytes_fetched'] > 15 * 500)
+                self.assertEqual(sorted(summary['phase_seconds']), ['fetch', 'parse', 'serialize'])
+                latency = summary['latency_ms']
+                self.assertTrue(0 < latency['p50'] <= latency['p90'] <= latency['max'])
+
+            def test_latency_sample_stays_bounded(self):
+                stats = ScrapeStats()
+                stats.latency_sample_size = 100
+                for i in range(1000):
+                    stats.record_fetch(i / 1000.0, 1)
+                self.assertEqual(len(stats.latencies), 100)
+                self.assertEqual(stats.requests, 1000)
+                self.assertTrue(300 < stats.latency_percentiles()['p50'] < 700)
+
+            def test_host_rate_limiter(self):
+                limiter = HostRateLimiter(requests_per_second=100)
+                start = time.time()
+                for _ in range(5):
+                    limiter.wait('example.com')
+                self.assertTrue(time.time() - start >= 0.04)
+
+        from fake_company_site import FakeCompanySite
         unittest.main()
 
     else:
-        origin_url = 'http://data-interview.enigmalabs.org/companies/'
-        output_filename = 'solution.json'
-        web_scrape(origin_url, output_filename)
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import instrumentation
+
+        parser = argparse.ArgumentParser(description='Scrape the company listings site')
+        parser.add_argument('url', nargs='?',
+                            default='http://data-interview.enigmalabs.org/companies/')
+        parser.add_argument('-o', '--output', default='solution.json',
+                            help='where to write the json, or JSON Lines if it ends in .jsonl '
+                                 '(default: solution.json)')
+        parser.add_argument('--resume', action='store_true',
+                            help="carry on from an interrupted run, skipping companies it wrote")
+        parser.add_argument('-c', '--concurrency', type=int, default=8,
+                            help='number of pages to fetch at once (default: 8)')
+        parser.add_argument('--rate-limit', type=float, metavar='REQUESTS_PER_SECOND',
+                            help='most requests to start per second for each host')
+        parser.add_argument('--retries', type=int, default=3,
+                            help='times to retry a failed request (default: 3)')
+        parser.add_argument('--timeout', type=float, default=10,
+                            help='seconds to wait on a request (default: 10)')
+        parser.add_argument('--fast', action='store_true',
+                            help='parse pages in one pass without building soups')
+        parser.add_argument('--stats', metavar='FILENAME',
+                            help='write a json summary of throughput, timings and errors')
+        parser.add_argument('--cache', metavar='FILENAME',
+                            help='keep fetched pages in an sqlite database between runs')
+        parser.add_argument('--cache-ttl', type=float, default=0,
+                            help='seconds to use cached pages for without revalidating them')
+        parser.add_argument('--cache-max-mb', type=float,
+                            help='most megabytes of pages to keep in the cache')
+        instrumentation.add_arguments(parser)
+        args = parser.parse_args()
+
+        cache = None
+        if args.cache:
+            max_bytes = int(args.cache_max_mb * 1024 * 1024) if args.cache_max_mb else None
+            cache = ResponseCache(args.cache, args.cache_ttl, max_bytes)
+        fetcher = Fetcher(args.concurrency, args.rate_limit, args.retries, timeout=args.timeout,
+                          cache=cache)
+        module = sys.modules[__name__]
+        # Pages are fetched through fetch_page, and parsed from their html,
+        # so get_soup isn't on the scrape's path
+        hot_functions = [(Fetcher, 'fetch_page', 'Fetcher.fetch_page'),
+                         (Fetcher, 'request', 'Fetcher.request'), (module, 'make_soup'),
+                         (module, 'parse_table_rows_for_company_data'), (module, 'extract_page')]
+        with instrumentation.instrumented(args, 'web_scrape', hot_functions):
+            summary = web_scrape(args.url, args.output, fetcher, args.fast, args.resume)
+        if args.stats:
+            with open(args.stats, 'wb') as stats_file:
+                json.dump(summary, stats_file, indent=4)
+        if cache:
+            print 'Cache: {hits} fresh, {revalidated} revalidated, {misses} downloaded'.format(
+                **cache.stats())